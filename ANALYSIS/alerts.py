@@ -0,0 +1,107 @@
+import math
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, timedelta
+
+import numpy as np
+
+from geodesy import point_bboxes
+
+# Danger level scoring shared by the /alert endpoints (ru4.py, run6.py) and benchmarks,
+# plus batch scoring of many locations from a few shared flood-mask fetches.
+
+HIGH_FLOOD_FRACTION = 0.4
+MODERATE_FLOOD_FRACTION = 0.1
+
+# Points whose centres fall in the same GROUP_DEG x GROUP_DEG cell share one fetch
+GROUP_DEG = 0.5
+
+# Requests without a time_interval look at the last ALERT_WINDOW_DAYS days, as does the risk grid
+ALERT_WINDOW_DAYS = 10
+
+
+def default_alert_interval(days=ALERT_WINDOW_DAYS):
+    today = date.today()
+    return str(today - timedelta(days=days)), str(today)
+
+
+def danger_level(fraction):
+    if fraction > HIGH_FLOOD_FRACTION:
+        return 'high'
+    if fraction > MODERATE_FLOOD_FRACTION:
+        return 'moderate'
+    return 'low'
+
+
+def score_flood(mask):
+    """(danger level, flooded fraction) of a PackedMask, counted on the packed bits."""
+    fraction = mask.fraction()
+    return danger_level(fraction), fraction
+
+
+def point_bbox(lat, lon, radius_km):
+    return point_bboxes(lat, lon, radius_km).tolist()
+
+
+def group_points(bboxes, lats, lons, group_deg=GROUP_DEG):
+    """Indices of the points in each group and the union bbox the group is fetched over."""
+    groups = {}
+    for i, (lat, lon) in enumerate(zip(lats, lons)):
+        groups.setdefault((math.floor(lat / group_deg), math.floor(lon / group_deg)), []).append(i)
+    result = []
+    for members in groups.values():
+        boxes = bboxes[members]
+        union = (boxes[:, 0].min(), boxes[:, 1].min(), boxes[:, 2].max(), boxes[:, 3].max())
+        result.append((np.array(members), union))
+    return result
+
+
+def window_fractions(mask, union, boxes):
+    """Flooded fraction inside each of `boxes` (N x [west, south, east, north]) of a mask over `union`.
+
+    One summed-area table of the mask answers every box with four lookups.
+    """
+    height, width = mask.shape
+    west, south, east, north = union
+    table = np.zeros((height + 1, width + 1), dtype=np.int32)
+    np.cumsum(np.cumsum(mask.to_bool(), axis=0, dtype=np.int32), axis=1, out=table[1:, 1:])
+
+    x0 = np.clip(np.round((boxes[:, 0] - west) / (east - west) * width), 0, width).astype(int)
+    x1 = np.clip(np.round((boxes[:, 2] - west) / (east - west) * width), 0, width).astype(int)
+    y0 = np.clip(np.round((north - boxes[:, 3]) / (north - south) * height), 0, height).astype(int)
+    y1 = np.clip(np.round((north - boxes[:, 1]) / (north - south) * height), 0, height).astype(int)
+    counts = table[y1, x1] - table[y0, x1] - table[y1, x0] + table[y0, x0]
+    areas = (x1 - x0) * (y1 - y0)
+    return np.divide(counts, areas, out=np.zeros(len(boxes)), where=areas > 0)
+
+
+def score_points(points, fetch_flood_mask, max_concurrency=4, group_deg=GROUP_DEG):
+    """Score many {"lat", "lon", "radius_km"} points, yielding one result dict per point.
+
+    Nearby points are grouped so each group is a single `fetch_flood_mask(bbox)` call
+    (returning a PackedMask); groups are fetched concurrently and their results are
+    yielded as soon as each group is done, tagged with the point's input `index`.
+    """
+    if not points:
+        return
+    lats = np.array([point["lat"] for point in points], dtype=float)
+    lons = np.array([point["lon"] for point in points], dtype=float)
+    radii = np.array([point.get("radius_km", 25) for point in points], dtype=float)
+    bboxes = point_bboxes(lats, lons, radii)
+
+    def score_group(members, union):
+        return members, window_fractions(fetch_flood_mask(union), union, bboxes[members])
+
+    with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as pool:
+        futures = {
+            pool.submit(score_group, members, union): members
+            for members, union in group_points(bboxes, lats, lons, group_deg)
+        }
+        for future in as_completed(futures):
+            try:
+                members, fractions = future.result()
+            except Exception as e:
+                for i in futures[future]:
+                    yield {"index": int(i), "error": str(e)}
+                continue
+            for i, fraction in zip(members, fractions):
+                yield {"index": int(i), "danger_level": danger_level(fraction), "flooded_fraction": float(fraction)}
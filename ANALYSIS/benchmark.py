@@ -0,0 +1,309 @@
+import argparse
+import functools
+import importlib
+import itertools
+import json
+import os
+import resource
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from fake_sentinelhub import FakeSentinelHub
+from render import render_flood_gif
+
+# Benchmarks the /flood_gif/ (run10.py) and /alert (run6.py) pipelines stage by stage against a
+# local fake Sentinel Hub, over a grid of radius / resolution / date-span sizes and with
+# cold or warm caches. Example:
+#
+#   python benchmark.py --radius 10 50 --resolution 60 --days 7 30 --latency 0.3
+
+LAT, LON = 17.387140, 78.491684  # Hyderabad
+
+
+def percentiles(samples):
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99]) if samples else (0, 0, 0)
+    return {"p50": p50, "p95": p95, "p99": p99}
+
+
+def rss_mb():
+    """Current resident set size. ru_maxrss would only ever rise, so it is read from /proc."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 ** 2
+    except OSError:
+        # No procfs (macOS): fall back to the peak, in bytes there
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 ** 2
+
+
+class PeakRss:
+    """Highest RSS since the last reset(). On Linux this is the kernel's own VmHWM, restarted
+    by writing 5 to /proc/self/clear_refs; elsewhere a thread samples rss_mb() every
+    `interval` seconds and so can miss shorter spikes."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.kernel = self._clear_refs()
+        self.sampled = rss_mb()
+        if not self.kernel:
+            threading.Thread(target=self._sample, daemon=True).start()
+
+    @staticmethod
+    def _clear_refs():
+        try:
+            with open("/proc/self/clear_refs", "w") as f:
+                f.write("5")
+            return True
+        except OSError:
+            return False
+
+    def _sample(self):
+        while True:
+            time.sleep(self.interval)
+            self.sampled = max(self.sampled, rss_mb())
+
+    def reset(self):
+        if self.kernel:
+            self._clear_refs()
+        else:
+            self.sampled = rss_mb()
+
+    def read(self):
+        if self.kernel:
+            with open("/proc/self/status") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        return int(line.split()[1]) / 1024
+        return max(self.sampled, rss_mb())
+
+
+peak_rss = PeakRss()
+
+
+class StageTimer:
+    """Durations and memory of each stage.
+
+    `peak` is the highest RSS while the stage ran. The peak counter is process-wide, so
+    every reset first folds the peak so far into all open stages: nested stages and, with
+    --concurrency > 1, stages running in other threads each still see the whole span.
+    `rss_growth` is what the stage still holds when it ends (its output and caches).
+    """
+
+    def __init__(self):
+        self.durations = defaultdict(list)
+        self.rss = {}
+        self.rss_growth = defaultdict(float)
+        self.peak = defaultdict(float)
+        self._open = Counter()
+        self._lock = threading.Lock()
+
+    def _observe(self):
+        peak = peak_rss.read()
+        for name, count in self._open.items():
+            if count:
+                self.peak[name] = max(self.peak[name], peak)
+        peak_rss.reset()
+
+    @contextmanager
+    def stage(self, name):
+        with self._lock:
+            self._observe()
+            self._open[name] += 1
+        before = rss_mb()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.durations[name].append(time.perf_counter() - start)
+            with self._lock:
+                self._observe()
+                self._open[name] -= 1
+            self.rss[name] = rss_mb()
+            self.rss_growth[name] = max(self.rss_growth[name], self.rss[name] - before)
+
+    def record(self, name, seconds):
+        """A sub-stage timed elsewhere (e.g. inside render_flood_gif); its peak is the enclosing stage's."""
+        self.durations[name].append(seconds)
+        self.rss[name] = rss_mb()
+
+
+# The timer of the benchmark run on this thread, for the stage wrappers installed by setup_service
+current = threading.local()
+
+
+def timed(fn, name):
+    """Wrap a service function so that every call is a stage of the calling thread's timer."""
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with current.timer.stage(name):
+            return fn(*args, **kwargs)
+
+    return wrapper
+
+
+# The module serving each pipeline
+SERVICES = {"flood_gif": "run10", "alert": "run6"}
+
+
+def setup_service(fake, cache_dir, name="run10"):
+    """Import a service module with its Sentinel Hub config and token manager pointed at the
+    fake server, and every cache it opens at import inside `cache_dir`."""
+    os.environ.setdefault("SH_CLIENT_ID", "benchmark")
+    os.environ.setdefault("SH_CLIENT_SECRET", "benchmark")
+    os.environ["GIF_CACHE_DIR"] = os.path.join(cache_dir, "gifs")
+    os.environ["RASTER_CACHE_DIR"] = os.path.join(cache_dir, "rasters")
+    os.environ["RISK_GRID_PATH"] = os.path.join(cache_dir, "risk_grid.sqlite")
+
+    from sentinelhub import DataCollection
+    from sh_session import get_config_token_manager
+
+    service = importlib.import_module(name)
+    service.config.sh_base_url = fake.base_url
+    service.config.sh_token_url = fake.token_url
+    service.token_manager = get_config_token_manager(service.config)
+    # Collections carry their own service URL, which wins over config.sh_base_url
+    service.DATA_COLLECTION = DataCollection.SENTINEL2_L1C.define_from("SENTINEL2_L1C_FAKE", service_url=fake.base_url)
+    if name == "run6":
+        # /alert runs unchanged; only the steps inside it are timed
+        service.get_new_flood_hazard_info = timed(service.get_new_flood_hazard_info, "fetch")
+        service.score_flood = timed(service.score_flood, "threshold")
+    return service
+
+
+def clear_caches(service):
+    if hasattr(service, "get_flood_image"):
+        service.get_flood_image.cache_clear()
+    service.raster_cache.clear()
+
+
+def run_flood_gif(run10, timer, radius_km, resolution, days):
+    end_date = datetime(2024, 9, 1)
+    time_interval = ((end_date - timedelta(days=days)).strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d"))
+    windows = run10.build_time_windows(time_interval, skip=1, consider=2)
+
+    # The same calls build_flood_gif makes, minus the frame cache and render pool
+    with timer.stage("fetch"):
+        day_results = run10.get_day_rasters(LAT, LON, radius_km, run10.build_window_days(windows), resolution)
+    with timer.stage("threshold"):
+        water_images, dates = run10.assemble_windows(windows, day_results, tot=0.5)
+    with tempfile.TemporaryDirectory() as gif_dir, timer.stage("render"):
+        render_timings = render_flood_gif(water_images, dates, os.path.join(gif_dir, "flood.gif"), 5, 20)
+    for name, seconds in render_timings.items():
+        timer.record(name, seconds)
+
+
+def run_alert(run6, timer, radius_km, resolution, days):
+    end_date = datetime(2024, 9, 1)
+    time_interval = ((end_date - timedelta(days=days)).strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d"))
+    query = {"lat": LAT, "lon": LON, "radius_km": radius_km, "resolution": resolution, "time_interval": time_interval}
+
+    # The real handler: risk grid lookup (empty here), then the live fetch and scoring
+    current.timer = timer
+    with timer.stage("handler"):
+        response = run6.app.test_client().get("/alert", json=query)
+    if response.status_code != 200:
+        raise RuntimeError(f"/alert returned {response.status_code}: {response.get_data(as_text=True)}")
+    return response.get_json()["danger_level"]
+
+
+PIPELINES = {"flood_gif": run_flood_gif, "alert": run_alert}
+
+
+def benchmark(service, pipeline, radius_km, resolution, days, cache, iterations, concurrency):
+    timer = StageTimer()
+    run = PIPELINES[pipeline]
+
+    if cache == "warm":
+        clear_caches(service)
+        run(service, StageTimer(), radius_km, resolution, days)
+
+    def one(_):
+        if cache == "cold":
+            clear_caches(service)
+        with timer.stage("total"):
+            run(service, timer, radius_km, resolution, days)
+
+    start = time.perf_counter()
+    # Cold runs clear the shared caches, so they are only meaningful one at a time
+    with ThreadPoolExecutor(max_workers=1 if cache == "cold" else concurrency) as pool:
+        list(pool.map(one, range(iterations)))
+    elapsed = time.perf_counter() - start
+
+    return {
+        "pipeline": pipeline,
+        "radius_km": radius_km,
+        "resolution": resolution,
+        "days": days,
+        "cache": cache,
+        "requests_per_second": iterations / elapsed,
+        "stages": {
+            name: {
+                **percentiles(samples),
+                "rss_mb": timer.rss.get(name, rss_mb()),
+                "rss_growth_mb": timer.rss_growth.get(name, 0.0),
+                "peak_rss_mb": timer.peak.get(name),
+            }
+            for name, samples in timer.durations.items()
+        },
+    }
+
+
+def print_result(result):
+    print(
+        f"\n{result['pipeline']}  radius={result['radius_km']}km  resolution={result['resolution']}m  "
+        f"days={result['days']}  cache={result['cache']}  {result['requests_per_second']:.2f} req/s"
+    )
+    print(f"  {'stage':<10} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'RSS MB':>10} {'+RSS MB':>10} {'peak MB':>10}")
+    for name, stats in result["stages"].items():
+        # Sub-stages recorded after the fact have no peak of their own
+        peak = "-" if stats["peak_rss_mb"] is None else f"{stats['peak_rss_mb']:.1f}"
+        print(
+            f"  {name:<10} {stats['p50'] * 1000:>10.1f} {stats['p95'] * 1000:>10.1f} "
+            f"{stats['p99'] * 1000:>10.1f} {stats['rss_mb']:>10.1f} {stats['rss_growth_mb']:>10.1f} {peak:>10}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the flood GIF and alert pipelines against a fake Sentinel Hub")
+    parser.add_argument("--pipeline", nargs="+", choices=list(PIPELINES), default=list(PIPELINES))
+    parser.add_argument("--radius", nargs="+", type=int, default=[10, 50])
+    parser.add_argument("--resolution", nargs="+", type=int, default=[60])
+    parser.add_argument("--days", nargs="+", type=int, default=[7, 30])
+    parser.add_argument("--cache", nargs="+", choices=["cold", "warm"], default=["cold", "warm"])
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=0.2, help="fake Process API latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.05)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    cache_dir = tempfile.mkdtemp(prefix="terra-sense-bench-")
+    results = []
+    try:
+        with FakeSentinelHub(args.latency, args.jitter) as fake:
+            services = {pipeline: setup_service(fake, cache_dir, SERVICES[pipeline]) for pipeline in args.pipeline}
+            for pipeline, radius_km, resolution, days, cache in itertools.product(
+                args.pipeline, args.radius, args.resolution, args.days, args.cache
+            ):
+                result = benchmark(services[pipeline], pipeline, radius_km, resolution, days, cache, args.iterations, args.concurrency)
+                print_result(result)
+                results.append(result)
+            print(f"\nFake Sentinel Hub served {fake.request_count} requests")
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
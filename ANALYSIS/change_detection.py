@@ -0,0 +1,272 @@
+import argparse
+import json
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from masks import PackedMask
+
+# Incremental change detection over a daily series of water masks. A FloodChangeTracker
+# keeps the last mask, the cumulative flood extent and a labelled map of connected
+# flood areas; each new day diffs against the last mask on the packed bits and only
+# re-labels the part of the map the difference touches, so a daily job can extend a
+# long series (saved with `save` / `load`) without revisiting its history.
+
+
+def label_components(mask):
+    """4-connected components of a boolean (H, W) mask: (int32 labels, 1..count, and count).
+
+    Works on horizontal runs of set pixels, joining runs that overlap in adjacent rows.
+    """
+    height, width = mask.shape
+    padded = np.zeros((height, width + 2), dtype=np.int8)
+    padded[:, 1:-1] = mask
+    edges = np.diff(padded, axis=1)
+    run_rows, run_starts = np.nonzero(edges == 1)
+    run_ends = np.nonzero(edges == -1)[1]
+    labels = np.zeros((height, width), dtype=np.int32)
+    if len(run_rows) == 0:
+        return labels, 0
+
+    # Runs sorted row-major on one axis; a run in row r + 1 overlaps the runs of row r
+    # whose end is after its start and whose start is before its end
+    stride = width + 2
+    start_keys = run_rows * stride + run_starts
+    end_keys = run_rows * stride + run_ends
+    lo = np.searchsorted(end_keys, start_keys - stride, side="right")
+    hi = np.searchsorted(start_keys, end_keys - stride, side="left")
+    counts = np.maximum(hi - lo, 0)
+    a = np.repeat(np.arange(len(run_rows)), counts)
+    b = np.repeat(lo, counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+
+    # Connected components of the run graph: propagate the smallest run index, then pointer-jump
+    roots = np.arange(len(run_rows))
+    while True:
+        smallest = np.minimum(roots[a], roots[b])
+        updated = roots.copy()
+        np.minimum.at(updated, a, smallest)
+        np.minimum.at(updated, b, smallest)
+        updated = updated[updated]
+        if np.array_equal(updated, roots):
+            break
+        roots = updated
+
+    run_labels = np.unique(roots, return_inverse=True)[1].astype(np.int32) + 1
+    lengths = run_ends - run_starts
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    labels[np.repeat(run_rows, lengths), np.repeat(run_starts, lengths) + offsets] = np.repeat(run_labels, lengths)
+    return labels, int(run_labels.max())
+
+
+def component_stats(labels, count):
+    """(area, y0, y1, x0, x1) per label 1..count, as a (count, 5) int64 array."""
+    ys, xs = np.nonzero(labels)
+    ids = labels[ys, xs] - 1
+    stats = np.empty((count, 5), dtype=np.int64)
+    stats[:, 0] = np.bincount(ids, minlength=count)
+    stats[:, 1] = stats[:, 3] = np.iinfo(np.int64).max
+    stats[:, 2] = stats[:, 4] = -1
+    np.minimum.at(stats[:, 1], ids, ys)
+    np.maximum.at(stats[:, 2], ids, ys + 1)
+    np.minimum.at(stats[:, 3], ids, xs)
+    np.maximum.at(stats[:, 4], ids, xs + 1)
+    return stats
+
+
+def _unpack_window(mask, window):
+    y0, y1, x0, x1 = window
+    bits = mask.bits[y0:y1, x0 // 8:(x1 + 7) // 8]
+    return np.unpackbits(bits, axis=-1)[:, x0 % 8:x0 % 8 + x1 - x0].view(bool)
+
+
+def _changed_window(delta):
+    """(y0, y1, x0, x1) around the set pixels of a PackedMask, whole bytes wide, or None."""
+    rows = np.flatnonzero(delta.bits.any(axis=1))
+    if len(rows) == 0:
+        return None
+    columns = np.flatnonzero(delta.bits.any(axis=0))
+    return rows[0], rows[-1] + 1, columns[0] * 8, min((columns[-1] + 1) * 8, delta.shape[1])
+
+
+class FloodChangeTracker:
+    """Running change detection over one area's daily masks.
+
+    `bounding_box` (west, south, east, north) and `resolution` (metres) are optional and
+    only used to report flood areas in degrees and km².
+    """
+
+    def __init__(self, shape, bounding_box=None, resolution=None):
+        self.shape = tuple(shape)
+        self.bounding_box = bounding_box
+        self.resolution = resolution
+        empty = PackedMask(np.zeros((self.shape[0], (self.shape[1] + 7) // 8), dtype=np.uint8), self.shape)
+        self.previous = empty
+        self.cumulative = empty
+        self.labels = np.zeros(self.shape, dtype=np.int32)
+        self.components = {}  # id -> [area, y0, y1, x0, x1]
+        self.next_id = 1
+        self.dates = []
+
+    def update(self, date, mask):
+        """Add the next day's PackedMask; returns that step's changes."""
+        if mask.shape != self.shape:
+            raise ValueError(f"Mask shape {mask.shape} does not match the series' {self.shape}")
+        if self.dates and date <= self.dates[-1]:
+            raise ValueError(f"{date} is not after the last tracked date {self.dates[-1]}")
+
+        new = mask.new_since(self.previous)
+        receded = mask.receded_since(self.previous)
+        delta = new | receded
+        window = _changed_window(delta)
+        changed = self._relabel(mask, new, delta, window) if window is not None else []
+
+        self.cumulative = self.cumulative | mask
+        self.previous = mask
+        self.dates.append(date)
+        return {
+            "date": date,
+            "new": new,
+            "receded": receded,
+            "new_pixels": new.count(),
+            "receded_pixels": receded.count(),
+            "flooded_pixels": mask.count(),
+            "cumulative_pixels": self.cumulative.count(),
+            "changed_components": [self.describe(component_id) for component_id in changed],
+        }
+
+    def _relabel(self, mask, new, delta, window):
+        """Re-label only the components next to changed pixels, plus the newly flooded pixels."""
+        height, width = self.shape
+        y0, y1, x0, x1 = window
+        # One pixel of margin catches components a change touches from outside its window
+        y0, y1, x0, x1 = max(y0 - 1, 0), min(y1 + 1, height), max(x0 - 1, 0), min(x1 + 1, width)
+        changed = _unpack_window(delta, (y0, y1, x0, x1))
+        near = changed.copy()
+        near[1:] |= changed[:-1]
+        near[:-1] |= changed[1:]
+        near[:, 1:] |= changed[:, :-1]
+        near[:, :-1] |= changed[:, 1:]
+        touched = np.unique(self.labels[y0:y1, x0:x1][near])
+        touched = touched[touched > 0]
+
+        # A pixel still flooded next to an untouched component would have joined it before,
+        # so the touched components and the new pixels can be re-labelled on their own
+        for component_id in touched.tolist():
+            _, cy0, cy1, cx0, cx1 = self.components.pop(component_id)
+            y0, y1, x0, x1 = min(y0, cy0), max(y1, cy1), min(x0, cx0), max(x1, cx1)
+        labels = self.labels[y0:y1, x0:x1]
+        old = np.isin(labels, touched)
+        region = (old | _unpack_window(new, (y0, y1, x0, x1))) & _unpack_window(mask, (y0, y1, x0, x1))
+        local, count = label_components(region)
+        labels[old] = 0
+        labels[region] = local[region] + (self.next_id - 1)
+
+        ids = list(range(self.next_id, self.next_id + count))
+        for component_id, (area, cy0, cy1, cx0, cx1) in zip(ids, component_stats(local, count).tolist()):
+            self.components[component_id] = [area, cy0 + y0, cy1 + y0, cx0 + x0, cx1 + x0]
+        self.next_id += count
+        return ids
+
+    def describe(self, component_id):
+        area, y0, y1, x0, x1 = self.components[component_id]
+        component = {"id": component_id, "area_pixels": area, "window": (y0, y1, x0, x1)}
+        if self.resolution:
+            component["area_km2"] = area * self.resolution ** 2 / 1e6
+        if self.bounding_box:
+            west, south, east, north = self.bounding_box
+            height, width = self.shape
+            component["bbox"] = (
+                west + (east - west) * x0 / width,
+                north - (north - south) * y1 / height,
+                west + (east - west) * x1 / width,
+                north - (north - south) * y0 / height,
+            )
+        return component
+
+    def flood_areas(self, min_pixels=1):
+        """Current connected flood areas, largest first."""
+        ids = sorted(self.components, key=lambda component_id: -self.components[component_id][0])
+        return [self.describe(component_id) for component_id in ids if self.components[component_id][0] >= min_pixels]
+
+    def save(self, path):
+        """Write the state atomically as one .npz file."""
+        table = np.array([[component_id] + stats for component_id, stats in self.components.items()], dtype=np.int64).reshape(-1, 6)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez_compressed(
+                    f,
+                    shape=np.array(self.shape),
+                    previous=self.previous.bits,
+                    cumulative=self.cumulative.bits,
+                    labels=self.labels,
+                    components=table,
+                    next_id=np.array(self.next_id),
+                    dates=np.array(self.dates, dtype="U10"),
+                    bounding_box=np.array(self.bounding_box if self.bounding_box else [], dtype=np.float64),
+                    resolution=np.array(self.resolution or 0, dtype=np.float64),
+                )
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as state:
+            shape = tuple(state["shape"].tolist())
+            tracker = cls(shape, tuple(state["bounding_box"].tolist()) or None, float(state["resolution"]) or None)
+            tracker.previous = PackedMask(state["previous"], shape)
+            tracker.cumulative = PackedMask(state["cumulative"], shape)
+            tracker.labels = state["labels"]
+            tracker.components = {int(row[0]): row[1:].tolist() for row in state["components"]}
+            tracker.next_id = int(state["next_id"])
+            tracker.dates = state["dates"].tolist()
+        return tracker
+
+
+def track_series(masks, dates, tracker=None, **kwargs):
+    """Feed a whole series (e.g. from get_range_of_flooding_areas) through a tracker; returns it and the steps."""
+    tracker = tracker or FloodChangeTracker(masks[0].shape, **kwargs)
+    steps = [tracker.update(date, mask) for mask, date in zip(masks, dates)]
+    return tracker, steps
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extend a region's flood change series by one day")
+    parser.add_argument("--bbox", required=True, type=float, nargs=4, metavar=("WEST", "SOUTH", "EAST", "NORTH"))
+    parser.add_argument("--state", required=True, help=".npz file holding the series so far; created if missing")
+    parser.add_argument("--date", default=datetime.now().strftime("%Y-%m-%d"))
+    parser.add_argument("--days", type=int, default=2, help="length of the imagery window ending on --date")
+    parser.add_argument("--resolution", type=int, default=60)
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    from pathlib import Path
+    from sentinelhub import SHConfig
+
+    from products import fetch_flood_mask
+
+    load_dotenv(dotenv_path=Path('.') / '.env')
+    config = SHConfig()
+    if not config.sh_client_id or not config.sh_client_secret:
+        raise Exception("Please provide the Sentinel Hub credentials in the .env file.")
+
+    end_date = datetime.strptime(args.date, "%Y-%m-%d")
+    time_interval = ((end_date - timedelta(days=args.days)).strftime("%Y-%m-%d"), args.date)
+    mask = fetch_flood_mask(tuple(args.bbox), time_interval, args.resolution, config)
+
+    if os.path.exists(args.state):
+        tracker = FloodChangeTracker.load(args.state)
+    else:
+        tracker = FloodChangeTracker(mask.shape, tuple(args.bbox), args.resolution)
+    step = tracker.update(args.date, mask)
+    tracker.save(args.state)
+
+    print(json.dumps({key: value for key, value in step.items() if key not in ("new", "receded")}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
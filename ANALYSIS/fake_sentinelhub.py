@@ -0,0 +1,190 @@
+import io
+import json
+import random
+import re
+import tarfile
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import tifffile
+from PIL import Image
+
+# Local stand-in for the Sentinel Hub OAuth and Process APIs, used by benchmark.py.
+# It never runs the evalscript: output ids, band counts and sample types are parsed
+# from its setup() and filled with a synthetic "river and flood plain" raster.
+# Multi-temporal evalscripts (those with an updateOutput()) get one acquisition per day
+# of the time range, most recent first: the declared bands repeat once per scene and a
+# "userdata" response lists the scene dates.
+
+OUTPUT_PATTERN = re.compile(r'\{\s*(?:id:\s*"(\w+)",\s*)?bands:\s*(\d+)(?:,\s*sampleType:\s*"(\w+)")?\s*\}')
+
+
+def parse_outputs(evalscript):
+    """(id, bands, sample_type) for every output declared in the evalscript's setup()."""
+    setup = evalscript.split("output", 1)[-1]
+    outputs = [(name or "default", int(bands), sample_type or "AUTO") for name, bands, sample_type in OUTPUT_PATTERN.findall(setup)]
+    return outputs or [("default", 1, "AUTO")]
+
+
+def synthetic_raster(width, height, bands, sample_type, seed=0):
+    """Deterministic water-like pattern: a meandering band of high values plus noise."""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    river = np.abs(y - height / 2 - height / 6 * np.sin(x / max(width, 1) * 2 * np.pi)) < height / 8
+    values = np.clip(0.3 + 0.5 * river + rng.normal(0, 0.1, (height, width)), 0, 1).astype(np.float32)
+    data = np.repeat(values[..., None], bands, axis=-1)
+    if sample_type == "FLOAT32":
+        return data
+    return (data * 255).astype(np.uint8)
+
+
+def scene_dates(payload):
+    """One acquisition per day of the request's time range, most recent first."""
+    time_range = payload["input"]["data"][0]["dataFilter"]["timeRange"]
+    day = datetime.strptime(time_range["from"][:10], "%Y-%m-%d")
+    last = datetime.strptime(time_range["to"][:10], "%Y-%m-%d")
+    dates = []
+    while day <= last:
+        dates.append(day.strftime("%Y-%m-%dT00:00:00Z"))
+        day += timedelta(days=1)
+    return dates[::-1]
+
+
+def encode(data, mime_type):
+    buffer = io.BytesIO()
+    if mime_type == "image/png":
+        Image.fromarray(data.squeeze() if data.shape[-1] == 1 else data).save(buffer, format="PNG")
+    else:
+        tifffile.imwrite(buffer, data.squeeze(-1) if data.shape[-1] == 1 else data)
+    return buffer.getvalue()
+
+
+class FakeSentinelHubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.server.request_count += 1
+        if self.path.endswith("/token"):
+            token = {"access_token": "fake-token", "token_type": "Bearer", "expires_in": 3600}
+            self._send(200, json.dumps(token).encode(), "application/json")
+        elif self.path.endswith("/api/v1/process"):
+            self._process(json.loads(body))
+        else:
+            self._send(404, b"{}", "application/json")
+
+    def _process(self, payload):
+        latency, jitter = self.server.latency, self.server.jitter
+        time.sleep(max(0.0, random.gauss(latency, jitter)))
+
+        width, height = payload["output"]["width"], payload["output"]["height"]
+        responses = payload["output"].get("responses") or [{"identifier": "default", "format": {"type": "image/tiff"}}]
+        outputs = {name: (bands, sample_type) for name, bands, sample_type in parse_outputs(payload["evalscript"])}
+        seed = zlib.crc32(json.dumps(payload["input"], sort_keys=True).encode())
+
+        dates = scene_dates(payload) if "updateOutput" in payload["evalscript"] else None
+        bounds = json.dumps(payload["input"]["bounds"], sort_keys=True)
+
+        files = {}
+        for response in responses:
+            name, mime_type = response["identifier"], response["format"]["type"]
+            if mime_type == "application/json":
+                files[f"{name}.json"] = json.dumps({"dates": dates or []}).encode()
+                continue
+            bands, sample_type = outputs.get(name, (1, "AUTO"))
+            extension = "png" if mime_type == "image/png" else "tif"
+            if dates is None:
+                data = synthetic_raster(width, height, bands, sample_type, seed)
+            elif dates:
+                # Each scene depends only on the area and its date, as a real acquisition would
+                data = np.concatenate([
+                    synthetic_raster(width, height, bands, sample_type, zlib.crc32(f"{bounds}_{date}".encode()))
+                    for date in dates
+                ], axis=-1)
+            else:
+                data = np.zeros((height, width, bands), dtype=np.float32 if sample_type == "FLOAT32" else np.uint8)
+            files[f"{name}.{extension}"] = encode(data, mime_type)
+
+        if len(files) == 1:
+            (filename, content), = files.items()
+            content_type = {"png": "image/png", "json": "application/json"}.get(filename.rsplit(".", 1)[-1], "image/tiff")
+            self._send(200, content, content_type)
+            return
+
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode="w") as tar:
+            for filename, content in files.items():
+                info = tarfile.TarInfo(filename)
+                info.size = len(content)
+                tar.addfile(info, io.BytesIO(content))
+        self._send(200, buffer.getvalue(), "application/x-tar")
+
+
+class FakeSentinelHub:
+    """Threaded fake Sentinel Hub server; use as a context manager.
+
+    `latency` / `jitter` (seconds) shape the delay of every Process API response.
+    """
+
+    def __init__(self, latency=0.2, jitter=0.05, host="127.0.0.1", port=0):
+        self.server = ThreadingHTTPServer((host, port), FakeSentinelHubHandler)
+        self.server.daemon_threads = True
+        self.server.latency = latency
+        self.server.jitter = jitter
+        self.server.request_count = 0
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def token_url(self):
+        return f"{self.base_url}/oauth/token"
+
+    @property
+    def request_count(self):
+        return self.server.request_count
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run a fake Sentinel Hub server")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--jitter", type=float, default=0.05)
+    args = parser.parse_args()
+
+    with FakeSentinelHub(args.latency, args.jitter, port=args.port) as fake:
+        print(f"Fake Sentinel Hub listening on {fake.base_url}")
+        threading.Event().wait()
@@ -0,0 +1,102 @@
+import asyncio
+import inspect
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+# Outcome of a single window: exactly one of `value` / `error` is meaningful.
+FetchResult = namedtuple("FetchResult", ["window", "value", "error"])
+
+
+class RateLimiter:
+    """Token bucket limiting how many requests are started per second.
+
+    One limiter can be shared by several fetches (and by the thread and the
+    asyncio engine at the same time) so that the whole process stays inside
+    the Sentinel Hub request budget.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(1.0, rate))
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self):
+        """Take a token if one is available, otherwise return the seconds to wait."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        while (wait := self._reserve()) > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        while (wait := self._reserve()) > 0:
+            await asyncio.sleep(wait)
+
+
+def _run_one(fetch, window, rate_limiter):
+    if rate_limiter is not None:
+        rate_limiter.acquire()
+    try:
+        return FetchResult(window, fetch(window), None)
+    except Exception as e:
+        return FetchResult(window, None, e)
+
+
+def fetch_windows(fetch, windows, max_concurrency=4, rate_limiter=None):
+    """Call `fetch(window)` for every window using a bounded thread pool.
+
+    Results come back in the same order as `windows`. A failing window does not
+    abort the others; its exception is returned in the `error` field instead.
+    `fetch` is any blocking callable, so the engine can be exercised against a
+    fake Process API by pointing `SHConfig.sh_base_url` at a local server.
+    """
+    windows = list(windows)
+    if not windows:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(windows)))) as pool:
+        return list(pool.map(lambda window: _run_one(fetch, window, rate_limiter), windows))
+
+
+async def _run_one_async(fetch, window, rate_limiter, is_coroutine):
+    if rate_limiter is not None:
+        await rate_limiter.acquire_async()
+    try:
+        if is_coroutine:
+            value = await fetch(window)
+        else:
+            value = await asyncio.to_thread(fetch, window)
+        return FetchResult(window, value, None)
+    except Exception as e:
+        return FetchResult(window, None, e)
+
+
+async def iter_fetch_windows_async(fetch, windows, max_concurrency=4, rate_limiter=None):
+    """Async generator over `FetchResult`s, yielded in window order as soon as each is ready.
+
+    At most `max_concurrency` windows are fetched ahead of the consumer, so a slow
+    consumer (e.g. a client reading a streamed GIF) never makes results pile up in
+    memory. Fetches still in flight are cancelled if the generator is closed early.
+    """
+    is_coroutine = inspect.iscoroutinefunction(fetch)
+    pending = deque()
+    try:
+        for window in windows:
+            pending.append(asyncio.ensure_future(_run_one_async(fetch, window, rate_limiter, is_coroutine)))
+            if len(pending) >= max(1, max_concurrency):
+                yield await pending.popleft()
+        while pending:
+            yield await pending.popleft()
+    finally:
+        for task in pending:
+            task.cancel()
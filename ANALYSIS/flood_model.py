@@ -0,0 +1,144 @@
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from sentinelhub import CRS, BBox, DataCollection
+
+from fetcher import fetch_windows
+from indices import RAW_BANDS, compute_indices
+from masks import PackedMask
+from products import fetch_bands
+from tiling import mosaic_masks, split_bbox
+
+# Serves a saved flood classifier (see train_spectral_model.py) to the APIs. The model is
+# loaded once per process and applied to whole rasters: pixels are scored in chunks
+# on a thread pool (tree ensembles release the GIL while predicting), giving a flood
+# probability map that can stand in for the fixed NDMI / NDWI thresholds.
+
+# The served model; train_flood_model.py's MCDWD model takes inputs the services don't have
+FLOOD_MODEL_PATH = os.getenv("FLOOD_MODEL_PATH", "models/flood_spectral.joblib")
+FLOOD_MODEL_WORKERS = int(os.getenv("FLOOD_MODEL_WORKERS") or os.cpu_count() or 1)
+FLOOD_MODEL_CHUNK_PIXELS = int(os.getenv("FLOOD_MODEL_CHUNK_PIXELS", str(256 * 1024)))
+FLOOD_PROBABILITY_THRESHOLD = float(os.getenv("FLOOD_PROBABILITY_THRESHOLD", "0.5"))
+
+# Features the services can compute from the Sentinel-2 bands they download
+SPECTRAL_FEATURES = set(RAW_BANDS) | {"ndmi", "ndwi", "ndvi", "evi"}
+
+
+class FloodModel:
+    """A fitted classifier with `predict_proba` and the names of the rasters it takes, in order."""
+
+    def __init__(self, model, feature_names, tag="", workers=FLOOD_MODEL_WORKERS, chunk_pixels=FLOOD_MODEL_CHUNK_PIXELS):
+        self.model = model
+        if hasattr(model, "n_jobs"):
+            # Parallelism comes from scoring chunks concurrently
+            model.n_jobs = 1
+        self.feature_names = list(feature_names)
+        # Identifies the model file in cache keys, so masks from another model are never reused
+        self.tag = tag
+        self.flood_column = list(model.classes_).index(1)
+        self.workers = workers
+        self.chunk_pixels = chunk_pixels
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path=FLOOD_MODEL_PATH, **kwargs):
+        import joblib
+
+        with open(path, "rb") as f:
+            tag = hashlib.sha1(f.read()).hexdigest()[:16]
+        saved = joblib.load(path)
+        return cls(saved["model"], saved["feature_names"], tag, **kwargs)
+
+    def is_spectral(self):
+        return set(self.feature_names) <= SPECTRAL_FEATURES
+
+    def _get_pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers)
+            return self._pool
+
+    def _predict_chunk(self, columns, out, start, stop):
+        X = np.empty((stop - start, len(columns)), dtype=np.float32)
+        for j, column in enumerate(columns):
+            X[:, j] = column[start:stop]
+        valid = ~np.isnan(X).any(axis=1)
+        chunk = out[start:stop]
+        chunk[:] = np.nan
+        if valid.any():
+            chunk[valid] = self.model.predict_proba(X[valid])[:, self.flood_column]
+
+    def predict_proba(self, rasters):
+        """Flood probability map (float32, NaN where any feature is NaN) from a dict of same-shape rasters."""
+        missing = [name for name in self.feature_names if name not in rasters]
+        if missing:
+            raise KeyError(f"The flood model needs features {missing}")
+        shape = np.shape(rasters[self.feature_names[0]])
+        columns = [np.asarray(rasters[name], dtype=np.float32).reshape(-1) for name in self.feature_names]
+        out = np.empty(columns[0].size, dtype=np.float32)
+
+        pool = self._get_pool()
+        futures = [
+            pool.submit(self._predict_chunk, columns, out, start, min(start + self.chunk_pixels, out.size))
+            for start in range(0, out.size, self.chunk_pixels)
+        ]
+        for future in futures:
+            future.result()
+        return out.reshape(shape)
+
+    def flood_mask(self, rasters, threshold=FLOOD_PROBABILITY_THRESHOLD):
+        """PackedMask of pixels above `threshold`; pixels without data count as dry."""
+        return PackedMask.from_bool(self.predict_proba(rasters) > threshold)
+
+    def close(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+
+def spectral_features(bands, feature_names):
+    """The rasters named in `feature_names` from a fetch_bands dict: raw bands as is, indices computed."""
+    computed = compute_indices(bands, [name for name in feature_names if name not in bands])
+    return {name: bands[name] if name in bands else computed[name] for name in feature_names}
+
+
+_models = {}
+_models_lock = threading.Lock()
+
+
+def get_flood_model(path=FLOOD_MODEL_PATH):
+    """The spectral model saved at `path`, loaded once per process, or None if there is none."""
+    with _models_lock:
+        if path not in _models:
+            _models[path] = _load_spectral_model(path)
+        return _models[path]
+
+
+def _load_spectral_model(path):
+    if not os.path.exists(path):
+        return None
+    model = FloodModel.load(path)
+    if not model.is_spectral():
+        print(f"Not serving {path}: it takes {model.feature_names}, the services only have {sorted(SPECTRAL_FEATURES)}")
+        return None
+    print(f"Serving flood model {path} on {model.feature_names}")
+    return model
+
+
+def fetch_model_mask(model, bounding_box, time_interval, resolution, config, data_collection=DataCollection.SENTINEL2_L1C, max_concurrency=4):
+    """Like products.fetch_flood_mask, with the flood model in place of the NDWI / NDVI rule."""
+    tiles, shape = split_bbox(bounding_box, resolution)
+
+    def fetch_tile(tile):
+        bands = fetch_bands(BBox(bbox=tile.bbox, crs=CRS.WGS84), tile.size, time_interval, config, data_collection)
+        return model.flood_mask(spectral_features(bands, model.feature_names))
+
+    results = fetch_windows(fetch_tile, tiles, max_concurrency=max_concurrency)
+    if all(result.error is not None for result in results):
+        raise results[0].error
+    return mosaic_masks(tiles, [result.value for result in results], shape)
@@ -0,0 +1,87 @@
+import functools
+
+import numpy as np
+
+# Vectorized versions of the per-point geometry the services do: the bounding box
+# `radius_km` around a point (the four geopy great_circle destinations) and its size in
+# pixels (sentinelhub's bbox_to_dimensions). Both take arrays, so the boxes of thousands
+# of points in a batch cost a handful of NumPy calls and one pyproj call per UTM zone.
+
+EARTH_RADIUS_KM = 6371.009  # geopy's mean Earth radius, so results match great_circle
+
+
+def normalize_longitude(lon):
+    """Longitudes outside [-180, 180] wrapped into [-180, 180), as geopy's Point does."""
+    lon = np.asarray(lon, dtype=float)
+    wrapped = np.fmod(lon, 360.0)
+    wrapped = np.where(wrapped < -180, wrapped + 360, np.where(wrapped >= 180, wrapped - 360, wrapped))
+    return np.where(np.abs(lon) > 180, wrapped, lon)
+
+
+def destination(lat, lon, distance_km, bearing):
+    """(lat, lon) reached from (lat, lon) after `distance_km` along a great circle at `bearing` degrees."""
+    lat1 = np.radians(lat)
+    lon1 = np.radians(lon)
+    bearing = np.radians(bearing)
+    angle = np.asarray(distance_km, dtype=float) / EARTH_RADIUS_KM
+
+    lat2 = np.arcsin(np.sin(lat1) * np.cos(angle) + np.cos(lat1) * np.sin(angle) * np.cos(bearing))
+    lon2 = lon1 + np.arctan2(np.sin(bearing) * np.sin(angle) * np.cos(lat1), np.cos(angle) - np.sin(lat1) * np.sin(lat2))
+    return np.degrees(lat2), normalize_longitude(np.degrees(lon2))
+
+
+def point_bboxes(lat, lon, radius_km):
+    """(..., 4) array of [west, south, east, north] boxes reaching `radius_km` from each point.
+
+    Takes scalars or broadcastable arrays; a single point gives a (4,) array. Uses
+    geopy's formula and agrees with it to within 1e-12 degrees (float rounding).
+    """
+    lat, lon, radius_km = np.broadcast_arrays(*(np.asarray(value, dtype=float) for value in (lat, lon, radius_km)))
+    north, _ = destination(lat, lon, radius_km, 0)
+    south, _ = destination(lat, lon, radius_km, 180)
+    _, east = destination(lat, lon, radius_km, 90)
+    _, west = destination(lat, lon, radius_km, 270)
+    return np.stack([west, south, east, north], axis=-1)
+
+
+def utm_epsg(lon, lat):
+    """EPSG code of the UTM zone of each point, with the Norway and Svalbard exceptions sentinelhub uses."""
+    lon = (np.asarray(lon, dtype=float) % 360 + 540) % 360 - 180
+    lat = np.asarray(lat, dtype=float)
+    zone = np.floor((lon + 180) / 6).astype(int) + 1
+    zone = np.where((lat >= 56) & (lat < 64) & (lon >= 3) & (lon < 12), 32, zone)
+    svalbard = (lat >= 72) & (lat <= 84) & (lon >= 0)
+    for start, end, svalbard_zone in ((0, 9, 31), (9, 21, 33), (21, 33, 35), (33, 42, 37)):
+        zone = np.where(svalbard & (lon >= start) & (lon < end), svalbard_zone, zone)
+    return np.where(lat >= 0, 32600, 32700) + zone
+
+
+@functools.lru_cache(maxsize=128)
+def _utm_transformer(epsg):
+    import pyproj
+
+    return pyproj.Transformer.from_crs("EPSG:4326", f"EPSG:{epsg}", always_xy=True)
+
+
+def bbox_dimensions(bboxes, resolution):
+    """(N, 2) int array of (width, height) for [west, south, east, north] rows, as bbox_to_dimensions gives.
+
+    Each box is measured in the UTM zone of its centre between its lower-left and
+    upper-right corners, like sentinelhub's to_utm_bbox.
+    """
+    bboxes = np.asarray(bboxes, dtype=float).reshape(-1, 4)
+    resx, resy = resolution if isinstance(resolution, tuple) else (resolution, resolution)
+    middle_lat = (bboxes[:, 1] + bboxes[:, 3]) / 2
+    if ((middle_lat < -80) | (middle_lat > 84)).any():
+        raise ValueError("UTM zones only cover latitudes between 80 deg S and 84 deg N")
+    epsg = utm_epsg((bboxes[:, 0] + bboxes[:, 2]) / 2, middle_lat)
+
+    extents = np.empty((len(bboxes), 2))
+    for code in np.unique(epsg).tolist():
+        rows = epsg == code
+        transform = _utm_transformer(code).transform
+        east1, north1 = transform(bboxes[rows, 0], bboxes[rows, 1])
+        east2, north2 = transform(bboxes[rows, 2], bboxes[rows, 3])
+        extents[rows, 0] = np.abs(east2 - east1) / resx
+        extents[rows, 1] = np.abs(north2 - north1) / resy
+    return np.round(extents).astype(int)
@@ -0,0 +1,115 @@
+import hashlib
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+# Date-aware expiry for everything cached per time interval. Imagery for the last day
+# or so is still arriving, so results over an interval that reaches into it ("open")
+# are only trusted for CACHE_OPEN_TTL; intervals that ended earlier ("closed") do not
+# change and rendered GIFs over them are kept for GIF_CLOSED_TTL. The day rasters and
+# per-window water masks in the RasterCache follow the same rule, which is what lets a
+# rolling 7-day GIF be rebuilt each day from the frames of the 6 days it shares with
+# the previous one.
+
+CACHE_OPEN_DAYS = int(os.getenv("CACHE_OPEN_DAYS", "1"))  # days before today still counted as open
+CACHE_OPEN_TTL = float(os.getenv("CACHE_OPEN_TTL", "3600"))  # seconds
+GIF_CLOSED_TTL = float(os.getenv("GIF_CLOSED_TTL", str(30 * 24 * 3600)))  # seconds
+GIF_CACHE_DIR = os.getenv("GIF_CACHE_DIR", "cache")
+GIF_CACHE_MAX_BYTES = int(os.getenv("GIF_CACHE_MAX_BYTES") or 512 * 1024 ** 2)
+
+
+def is_open(time_interval, now=None):
+    """Whether imagery for `time_interval` (inclusive ISO dates) may still be arriving."""
+    now = now or datetime.now()
+    return time_interval[1] >= (now - timedelta(days=CACHE_OPEN_DAYS)).strftime("%Y-%m-%d")
+
+
+def max_age_for(time_interval, closed_max_age=None):
+    """How long, in seconds, a result over `time_interval` stays valid (None for no limit)."""
+    return CACHE_OPEN_TTL if is_open(time_interval) else closed_max_age
+
+
+class GifCache:
+    """Rendered GIFs on disk, expired by `max_age_for` their dates and evicted LRU past `max_bytes`.
+
+    Files are written by the renderers (atomically, under `path`); `add` accounts for
+    them once in place. The size last counted for each path is kept, so a GIF rendered
+    again over an existing one only adds the difference.
+    """
+
+    def __init__(self, directory=GIF_CACHE_DIR, max_bytes=GIF_CACHE_MAX_BYTES, closed_max_age=GIF_CLOSED_TTL):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.closed_max_age = closed_max_age
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._sizes = {path: size for path, size, _ in self._entries()}
+        self._bytes = sum(self._sizes.values())
+
+    def path(self, lat, lon, radius_km, time_interval, *extra):
+        hash_input = f"{lat}_{lon}_{radius_km}_{time_interval}"
+        for value in extra:
+            hash_input += f"_{value}"
+        hash_key = hashlib.md5(hash_input.encode()).hexdigest()
+        return os.path.join(self.directory, f"flooding_{hash_key}.gif")
+
+    def _entries(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not (entry.name.startswith("flooding_") and entry.name.endswith(".gif")):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((entry.path, stat.st_size, stat.st_atime))
+        return entries
+
+    def get(self, path, time_interval):
+        """Whether a fresh GIF for `time_interval` is at `path`; an expired one is removed."""
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return False
+        max_age = max_age_for(time_interval, self.closed_max_age)
+        if max_age is not None and time.time() - stat.st_mtime > max_age:
+            self._remove(path)
+            return False
+        # The access time is the LRU timestamp; the modification time keeps the age
+        os.utime(path, (time.time(), stat.st_mtime))
+        return True
+
+    def add(self, path):
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            self._bytes += size - self._sizes.get(path, 0)
+            self._sizes[path] = size
+            if self._bytes > self.max_bytes:
+                self._evict()
+
+    def _remove(self, path):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            self._bytes -= self._sizes.pop(path, 0)
+
+    def _evict(self):
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        self._sizes = {path: size for path, size, _ in entries}
+        for path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            del self._sizes[path]
+        self._bytes = total
@@ -0,0 +1,173 @@
+import math
+import os
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# Shared access layer for MODIS MCDWD tiles, whether stored as HDF4-EOS (read with pyhdf)
+# or HDF5 (read with h5py). A tile is opened once, subdatasets are read lazily and only
+# for the requested window, and open handles are kept in a small LRU so analyses that
+# touch several subdatasets (Flood_1Day, Flood_2Day, Flood_3Day, FloodCS, TotalCounts)
+# or several passes over the same tile do not reopen it.
+
+HDF4_SIGNATURE = b"\x0e\x03\x13\x01"
+HDF5_SIGNATURE = b"\x89HDF\r\n\x1a\n"
+
+# MODIS sinusoidal grid: sphere radius, tile size and upper-left corner of tile h00v00, in metres
+SINUSOIDAL_RADIUS = 6371007.181
+SINUSOIDAL_TILE_SIZE = 1111950.5197665554
+SINUSOIDAL_ORIGIN = (-20015109.354, 10007554.677)
+
+TILE_PATTERN = re.compile(r"\.h(\d{2})v(\d{2})\.")
+
+HDF_HANDLE_CACHE_SIZE = int(os.getenv("HDF_HANDLE_CACHE_SIZE", "16"))
+
+
+def detect_format(path):
+    with open(path, "rb") as f:
+        header = f.read(8)
+    if header[:4] == HDF4_SIGNATURE:
+        return "hdf4"
+    if header == HDF5_SIGNATURE:
+        return "hdf5"
+    raise ValueError(f"{path} is neither an HDF4 nor an HDF5 file")
+
+
+def field_name(name):
+    """'Grid_Water_Composite:Flood_1Day_250m' (GDAL style) or an HDF5 path -> 'Flood_1Day_250m'."""
+    return name.split(":")[-1].split("/")[-1]
+
+
+class HDFTile:
+    """One open MCDWD tile. `read(name, window)` returns only the (y0, y1, x0, x1) window."""
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.format = detect_format(self.path)
+        self._datasets = {}
+        self._lock = threading.Lock()
+        if self.format == "hdf4":
+            from pyhdf.SD import SD, SDC
+            self._file = SD(self.path, SDC.READ)
+            self._names = list(self._file.datasets())
+        else:
+            import h5py
+            self._file = h5py.File(self.path, "r")
+            self._paths = {}
+            self._file.visititems(self._index_hdf5)
+            self._names = list(self._paths)
+
+    def _index_hdf5(self, path, item):
+        if hasattr(item, "shape") and hasattr(item, "dtype"):
+            self._paths.setdefault(path.split("/")[-1], path)
+
+    def names(self):
+        return list(self._names)
+
+    def _dataset(self, name):
+        field = field_name(name)
+        dataset = self._datasets.get(field)
+        if dataset is None:
+            if field not in self._names:
+                raise KeyError(f"{name} not found in {self.path}; available: {', '.join(self._names)}")
+            if self.format == "hdf4":
+                dataset = self._file.select(field)
+            else:
+                dataset = self._file[self._paths[field]]
+            self._datasets[field] = dataset
+        return dataset
+
+    def shape(self, name):
+        with self._lock:
+            dataset = self._dataset(name)
+            return tuple(dataset.info()[2]) if self.format == "hdf4" else dataset.shape
+
+    def read(self, name, window=None):
+        """Read a subdataset, or just its (y0, y1, x0, x1) window; both libraries read only that hyperslab."""
+        with self._lock:
+            dataset = self._dataset(name)
+            if window is None:
+                return np.asarray(dataset[:])
+            y0, y1, x0, x1 = window
+            return np.asarray(dataset[y0:y1, x0:x1])
+
+    def read_many(self, names, window=None):
+        return {field_name(name): self.read(name, window) for name in names}
+
+    def tile_id(self):
+        match = TILE_PATTERN.search(os.path.basename(self.path))
+        if match is None:
+            raise ValueError(f"No hXXvYY tile id in {self.path}")
+        return int(match.group(1)), int(match.group(2))
+
+    def bbox_window(self, bounding_box, name):
+        """(y0, y1, x0, x1) window of subdataset `name` covering (west, south, east, north), clipped to the tile."""
+        height, width = self.shape(name)[:2]
+        return sinusoidal_window(bounding_box, self.tile_id(), width, height)
+
+    def read_bbox(self, name, bounding_box):
+        return self.read(name, self.bbox_window(bounding_box, name))
+
+    def close(self):
+        with self._lock:
+            if self.format == "hdf4":
+                for dataset in self._datasets.values():
+                    dataset.endaccess()
+                self._file.end()
+            else:
+                self._file.close()
+            self._datasets.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def sinusoidal_window(bounding_box, tile, width, height):
+    """Pixel window of a WGS84 bbox in MODIS sinusoidal tile (h, v) with `width` x `height` pixels."""
+    west, south, east, north = bounding_box
+    h, v = tile
+    x_min = SINUSOIDAL_ORIGIN[0] + h * SINUSOIDAL_TILE_SIZE
+    y_max = SINUSOIDAL_ORIGIN[1] - v * SINUSOIDAL_TILE_SIZE
+    pixel_x = SINUSOIDAL_TILE_SIZE / width
+    pixel_y = SINUSOIDAL_TILE_SIZE / height
+
+    # x = R * lon * cos(lat) is widest at the latitude closest to the equator
+    lats = [south, north] + ([0.0] if south < 0 < north else [])
+    xs = [SINUSOIDAL_RADIUS * math.radians(lon) * math.cos(math.radians(lat)) for lon in (west, east) for lat in lats]
+    ys = [SINUSOIDAL_RADIUS * math.radians(lat) for lat in (south, north)]
+
+    x0 = min(max(math.floor((min(xs) - x_min) / pixel_x), 0), width)
+    x1 = min(max(math.ceil((max(xs) - x_min) / pixel_x), 0), width)
+    y0 = min(max(math.floor((y_max - max(ys)) / pixel_y), 0), height)
+    y1 = min(max(math.ceil((y_max - min(ys)) / pixel_y), 0), height)
+    return y0, y1, x0, x1
+
+
+_handles = OrderedDict()
+_handles_lock = threading.Lock()
+
+
+def open_tile(path):
+    """Shared, cached HDFTile for `path`; the least recently used handles are closed past HDF_HANDLE_CACHE_SIZE."""
+    key = os.path.realpath(path)
+    with _handles_lock:
+        tile = _handles.get(key)
+        if tile is not None:
+            _handles.move_to_end(key)
+            return tile
+        tile = _handles[key] = HDFTile(key)
+        while len(_handles) > HDF_HANDLE_CACHE_SIZE:
+            _, evicted = _handles.popitem(last=False)
+            evicted.close()
+        return tile
+
+
+def close_all():
+    with _handles_lock:
+        while _handles:
+            _handles.popitem()[1].close()
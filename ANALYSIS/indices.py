@@ -0,0 +1,107 @@
+import inspect
+
+import numpy as np
+
+# Local counterparts of the spectral indices computed in our evalscripts. Inputs are
+# raw reflectance arrays of any shape - (H, W) for one scene or (T, H, W) for a time
+# series - so many dates are processed in a single vectorized pass.
+
+RAW_BANDS = ["B02", "B03", "B04", "B08", "B11"]
+
+
+def normalized_difference(a, b, out=None, nodata=np.nan):
+    """(a - b) / (a + b) in float32, with `nodata` where the denominator is zero."""
+    a = np.asarray(a, dtype=np.float32)
+    b = np.asarray(b, dtype=np.float32)
+    if out is None:
+        out = np.empty(np.broadcast_shapes(a.shape, b.shape), dtype=np.float32)
+    denominator = np.add(a, b)
+    np.subtract(a, b, out=out)
+    zero = denominator == 0
+    np.divide(out, denominator, out=out, where=~zero)
+    out[zero] = nodata
+    return out
+
+
+def ndmi(bands, out=None):
+    return normalized_difference(bands["B08"], bands["B11"], out=out)
+
+
+def ndwi(bands, out=None):
+    return normalized_difference(bands["B03"], bands["B08"], out=out)
+
+
+def ndvi(bands, out=None):
+    # Same B08/B02 pairing as the flood rule in get_new_flood_hazard_info
+    return normalized_difference(bands["B08"], bands["B02"], out=out)
+
+
+def evi(bands, out=None, nodata=np.nan):
+    b02 = np.asarray(bands["B02"], dtype=np.float32)
+    b04 = np.asarray(bands["B04"], dtype=np.float32)
+    b08 = np.asarray(bands["B08"], dtype=np.float32)
+    if out is None:
+        out = np.empty(b08.shape, dtype=np.float32)
+    denominator = b08 + 6 * b04 - 7.5 * b02 + 1
+    np.subtract(b08, b04, out=out)
+    out *= 2.5
+    zero = denominator == 0
+    np.divide(out, denominator, out=out, where=~zero)
+    out[zero] = nodata
+    return out
+
+
+def true_color(bands, out=None):
+    return np.stack([bands["B04"], bands["B03"], bands["B02"]], axis=-1, out=out)
+
+
+def flood(bands, out=None, ndwi_threshold=0.005, ndvi_threshold=0.005):
+    """Boolean flood mask: NDWI and NDVI both above their thresholds (NaN counts as dry)."""
+    scratch = ndwi(bands)
+    out = np.greater(scratch, ndwi_threshold, out=out)
+    ndvi(bands, out=scratch)
+    out &= scratch > ndvi_threshold
+    return out
+
+
+def water(bands, out=None, tot=0.5):
+    """NDMI water mask matching `ndmi_data > tot * 255` on the AUTO-scaled rasters."""
+    return np.greater(ndmi(bands), tot, out=out)
+
+
+INDICES = {
+    "true_color": true_color,
+    "evi": evi,
+    "ndmi": ndmi,
+    "ndwi": ndwi,
+    "ndvi": ndvi,
+    "flood": flood,
+    "water": water,
+}
+
+
+def split_bands(stack, band_names=RAW_BANDS, data_mask=None):
+    """Turn a (..., len(band_names)) stack into a dict of float32 bands.
+
+    Pixels where `data_mask` is zero are set to NaN so every index treats them as nodata.
+    """
+    stack = np.asarray(stack, dtype=np.float32)
+    if data_mask is not None:
+        stack = np.where(np.asarray(data_mask)[..., None] > 0, stack, np.float32(np.nan))
+    return {name: stack[..., i] for i, name in enumerate(band_names)}
+
+
+def compute_indices(bands, names, out=None, **params):
+    """Compute several indices from the same band arrays.
+
+    `out` may map index names to preallocated buffers that are written in place;
+    extra keyword arguments (e.g. `tot`, `ndwi_threshold`) go to the indices accepting them.
+    """
+    out = out or {}
+    results = {}
+    for name in names:
+        func = INDICES[name]
+        accepted = inspect.signature(func).parameters
+        kwargs = {key: value for key, value in params.items() if key in accepted}
+        results[name] = func(bands, out=out.get(name), **kwargs)
+    return results
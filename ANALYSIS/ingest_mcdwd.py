@@ -0,0 +1,168 @@
+import argparse
+import os
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+# hdf_access reads HDF_HANDLE_CACHE_SIZE when it is imported
+load_dotenv(dotenv_path=Path('.') / '.env')
+
+from hdf_access import open_tile
+
+# Ingests a directory of MCDWD_L3_NRT tiles (any days, any h/v tiles) into one HDF5
+# store holding, per tile and subdataset, a chunked and gzip-compressed (time, y, x)
+# cube plus the date of every time step. HDF decoding happens once, here, in worker
+# processes; analyses then slice dates and windows straight from the cube, and h5py
+# only decompresses the chunks that overlap the slice. Re-running skips days already
+# ingested, so the store can be topped up as new tiles arrive.
+
+FILENAME_PATTERN = re.compile(r"MCDWD_L3_NRT\.A(\d{4})(\d{3})\.h(\d{2})v(\d{2})\.\d{3}\.hdf$")
+
+DEFAULT_SUBDATASETS = [
+    "Flood_1Day_250m",
+    "Flood_2Day_250m",
+    "Flood_3Day_250m",
+    "FloodCS_1Day_250m",
+    "TotalCounts_1Day_250m",
+]
+
+# (time, y, x) chunk: a few weeks of a 256 x 256 window decompresses in one go
+CHUNK_SHAPE = (16, 256, 256)
+
+
+def scan_tiles(directory):
+    """(date, tile, path) for every MCDWD file under `directory`, sorted by date then tile."""
+    found = []
+    for root, _, files in os.walk(directory):
+        for name in files:
+            match = FILENAME_PATTERN.search(name)
+            if match is None:
+                continue
+            year, day_of_year, h, v = (int(group) for group in match.groups())
+            date = (datetime(year, 1, 1) + timedelta(days=day_of_year - 1)).strftime("%Y-%m-%d")
+            found.append((date, f"h{h:02d}v{v:02d}", os.path.join(root, name)))
+    return sorted(found)
+
+
+def decode_tile(path, subdatasets):
+    """Worker-process side: every requested subdataset of one file, missing ones as None."""
+    tile = open_tile(path)
+    names = set(tile.names())
+    return {name: tile.read(name) if name in names else None for name in subdatasets}
+
+
+class FloodCube:
+    """Reader/writer for the ingested store: /<tile>/<subdataset> cubes and /<tile>/dates."""
+
+    def __init__(self, path, mode="r"):
+        import h5py
+        self.file = h5py.File(path, mode)
+
+    def tiles(self):
+        return list(self.file.keys())
+
+    def dates(self, tile):
+        if tile not in self.file:
+            return []
+        return [date.decode() for date in self.file[tile]["dates"][:]]
+
+    def append(self, tile, date, arrays):
+        group = self.file.require_group(tile)
+        if "dates" not in group:
+            group.create_dataset("dates", shape=(0,), maxshape=(None,), dtype="S10", chunks=(1024,))
+        dates = group["dates"]
+        index = dates.shape[0]
+
+        for name, array in arrays.items():
+            if name not in group:
+                chunks = (CHUNK_SHAPE[0],) + tuple(min(c, s) for c, s in zip(CHUNK_SHAPE[1:], array.shape))
+                group.create_dataset(
+                    name, shape=(0,) + array.shape, maxshape=(None,) + array.shape, dtype=array.dtype,
+                    chunks=chunks, compression="gzip", compression_opts=4, shuffle=True,
+                    fillvalue=0,
+                )
+            cube = group[name]
+            cube.resize(index + 1, axis=0)
+            cube[index] = array
+        # Subdatasets absent from this file keep the fill value at this step
+        for name in group:
+            if name != "dates" and group[name].shape[0] < index + 1:
+                group[name].resize(index + 1, axis=0)
+
+        dates.resize(index + 1, axis=0)
+        dates[index] = date.encode()
+
+    def read(self, tile, subdataset, start_date=None, end_date=None, window=None):
+        """(dates, (time, y, x) array) between two inclusive ISO dates, optionally a (y0, y1, x0, x1) window."""
+        dates = self.dates(tile)
+        steps = [i for i, date in enumerate(dates) if (start_date is None or date >= start_date) and (end_date is None or date <= end_date)]
+        if not steps:
+            return [], None
+        cube = self.file[tile][subdataset]
+        y0, y1, x0, x1 = window or (0, cube.shape[1], 0, cube.shape[2])
+        # Dates are appended in order, so the selection is one contiguous run of steps
+        data = cube[steps[0]:steps[-1] + 1, y0:y1, x0:x1]
+        return [dates[i] for i in steps], data
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def ingest(directory, store_path, subdatasets=DEFAULT_SUBDATASETS, workers=None):
+    """Decode every not yet ingested tile under `directory` in parallel and append it to the store."""
+    with FloodCube(store_path, "a") as cube:
+        # Only dates after the last ingested one can be appended while keeping each cube in order
+        last = {tile: (cube.dates(tile) or [""])[-1] for tile in cube.tiles()}
+        # One file per tile and day (a later collection version replaces an earlier one)
+        latest = {(date, tile): path for date, tile, path in scan_tiles(directory) if date > last.get(tile, "")}
+        todo = [(date, tile, path) for (date, tile), path in sorted(latest.items())]
+        print(f"Ingesting {len(todo)} tile-days into {store_path}")
+
+        workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = deque()
+            # Keep a bounded number of decoded tiles in flight so memory stays flat
+            for item in todo:
+                pending.append((item, pool.submit(decode_tile, item[2], subdatasets)))
+                if len(pending) >= 2 * workers:
+                    _write(cube, *pending.popleft())
+            while pending:
+                _write(cube, *pending.popleft())
+
+
+def _write(cube, item, future):
+    date, tile, path = item
+    try:
+        arrays = future.result()
+    except Exception as e:
+        print(f"Skipping {path}: {e}")
+        return
+    missing = [name for name, array in arrays.items() if array is None]
+    if missing:
+        print(f"{path} has no {', '.join(missing)}")
+    cube.append(tile, date, {name: array for name, array in arrays.items() if array is not None})
+    print(f"Ingested {tile} {date}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest MCDWD tiles into a chunked (time, y, x) HDF5 store")
+    parser.add_argument("directory", help="directory scanned recursively for MCDWD_L3_NRT.*.hdf files")
+    parser.add_argument("store", help="output HDF5 file, created or appended to")
+    parser.add_argument("--subdatasets", nargs="+", default=DEFAULT_SUBDATASETS)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+    ingest(args.directory, args.store, args.subdatasets, args.workers)
+
+
+if __name__ == "__main__":
+    main()
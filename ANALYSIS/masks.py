@@ -0,0 +1,95 @@
+import numpy as np
+
+# Water masks only hold 0 or 1, so they are kept packed 8 pixels per byte: 32x smaller
+# than the float32 images they replace. Counting and diffing work on the packed bytes.
+
+if hasattr(np, "bitwise_count"):
+    def _popcount(bits):
+        return int(np.bitwise_count(bits).sum(dtype=np.int64))
+else:
+    _POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def _popcount(bits):
+        return int(_POPCOUNT[bits].sum(dtype=np.int64))
+
+
+class PackedMask:
+    """Boolean (H, W) mask stored row by row as packed bits.
+
+    Padding bits at the end of each row are always zero, so popcounts and the
+    bitwise operators can run directly on the packed bytes.
+    """
+
+    __slots__ = ("bits", "shape")
+
+    def __init__(self, bits, shape):
+        self.bits = bits
+        self.shape = tuple(shape)
+
+    @classmethod
+    def from_bool(cls, mask):
+        mask = np.asarray(mask, dtype=bool)
+        return cls(np.packbits(mask, axis=-1), mask.shape)
+
+    @classmethod
+    def from_buffer(cls, buffer):
+        """Inverse of `to_buffer`; `buffer` may be a read-only memory map."""
+        height, width = (int(value) for value in np.asarray(buffer[:8]).view("<u4"))
+        return cls(buffer[8:].reshape(height, -1), (height, width))
+
+    def to_buffer(self):
+        """Flat uint8 array (height and width as uint32, then the packed rows) for RasterCache."""
+        header = np.array(self.shape, dtype="<u4").view(np.uint8)
+        return np.concatenate([header, self.bits.ravel()])
+
+    def to_bool(self):
+        return np.unpackbits(self.bits, axis=-1, count=self.shape[-1]).view(bool)
+
+    def __array__(self, dtype=None, copy=None):
+        mask = self.to_bool()
+        return mask if dtype is None else mask.astype(dtype)
+
+    @property
+    def size(self):
+        return self.shape[0] * self.shape[1]
+
+    @property
+    def nbytes(self):
+        return self.bits.nbytes
+
+    def count(self):
+        return _popcount(self.bits)
+
+    def fraction(self):
+        return self.count() / self.size if self.size else 0.0
+
+    def _check(self, other):
+        if self.shape != other.shape:
+            raise ValueError(f"Mask shapes differ: {self.shape} and {other.shape}")
+
+    def __and__(self, other):
+        self._check(other)
+        return PackedMask(self.bits & other.bits, self.shape)
+
+    def __or__(self, other):
+        self._check(other)
+        return PackedMask(self.bits | other.bits, self.shape)
+
+    def __xor__(self, other):
+        self._check(other)
+        return PackedMask(self.bits ^ other.bits, self.shape)
+
+    def __eq__(self, other):
+        return isinstance(other, PackedMask) and self.shape == other.shape and np.array_equal(self.bits, other.bits)
+
+    def __repr__(self):
+        return f"PackedMask(shape={self.shape}, count={self.count()})"
+
+    def new_since(self, earlier):
+        """Pixels set here but not in `earlier` (newly flooded)."""
+        self._check(earlier)
+        return PackedMask(self.bits & ~earlier.bits, self.shape)
+
+    def receded_since(self, earlier):
+        """Pixels set in `earlier` but no longer here (water receded)."""
+        return earlier.new_since(self)
@@ -0,0 +1,139 @@
+import argparse
+import asyncio
+import heapq
+import json
+import os
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+# PREWARM_* below, and run10's settings, are read at import
+load_dotenv(dotenv_path=Path('.') / '.env')
+
+from alerts import ALERT_WINDOW_DAYS, default_alert_interval
+
+# Pre-warms the caches behind /flood_gif/, /flood_map/ and /alert for watched regions, so
+# the first user to open a flooding district gets a cached answer. Runs as its own
+# process next to the API workers, sharing their on-disk caches:
+#
+#     python prewarm.py --regions regions.json
+#
+# regions.json lists {"name", "lat", "lon", "radius_km"} points (the default 7-day GIF is
+# rendered) and/or {"name", "bbox": [west, south, east, north]} areas (the day's tile
+# rasters are fetched for /flood_map/ and the risk grid cells refreshed for /alert).
+# Giving a region a past Sentinel-2 "acquisition" date (YYYY-MM-DD) schedules it for a
+# few hours after each expected revisit; other regions are refreshed every --interval.
+
+PREWARM_CONCURRENCY = int(os.getenv("PREWARM_CONCURRENCY", "2"))  # regions warmed at once
+PREWARM_DELAY_HOURS = float(os.getenv("PREWARM_DELAY_HOURS", "6"))  # acquisition to L1C availability
+SENTINEL2_REVISIT_DAYS = 5
+
+
+def next_run(region, now, interval):
+    """When `region` is next due: after its next expected acquisition, or `interval` seconds from now."""
+    acquisition = region.get("acquisition")
+    if acquisition is None:
+        return now + timedelta(seconds=interval)
+    revisit = timedelta(days=region.get("revisit_days", SENTINEL2_REVISIT_DAYS))
+    due = datetime.strptime(acquisition, "%Y-%m-%d") + timedelta(hours=PREWARM_DELAY_HOURS)
+    if due <= now:
+        due += revisit * ((now - due) // revisit + 1)
+    return due
+
+
+def region_name(region):
+    return region.get("name") or region.get("bbox") or (region["lat"], region["lon"])
+
+
+async def prewarm_gif(run10, region):
+    """Render the GIF create_flood_gif serves for this point without dates."""
+    lat, lon, radius_km = run10.canonical_point(region["lat"], region["lon"], region.get("radius_km", 10))
+    start_date, end_date = run10.default_time_interval()
+    gif_path = run10.get_gif_cache_filename(lat, lon, radius_km, (start_date, end_date))
+    await run10.build_flood_gif(lat, lon, radius_km, start_date, end_date, gif_path)
+
+
+async def prewarm_area(run10, region, grid, fetch_flood_mask, risk_days):
+    bounding_box = tuple(region["bbox"])
+    resolution = region.get("resolution", 60)
+    # Fills the tile raster cache that /flood_map/ reads for its default window
+    await asyncio.to_thread(run10.get_large_area_flood_image, bounding_box, run10.default_time_interval(), resolution)
+    if grid is not None:
+        from risk_grid import grid_method, refresh_region
+
+        await asyncio.to_thread(
+            refresh_region, grid, bounding_box, default_alert_interval(risk_days), fetch_flood_mask,
+            grid_method(run10.served_model()), resolution,
+        )
+
+
+async def prewarm(regions, interval, once=False, concurrency=PREWARM_CONCURRENCY, grid=None, risk_days=ALERT_WINDOW_DAYS):
+    import run10
+    from flood_model import fetch_model_mask
+    from products import fetch_flood_mask
+
+    semaphore = asyncio.Semaphore(concurrency)
+    # Risk grid cells are computed the way /alert computes a live answer
+    flood_model = run10.served_model()
+    if flood_model is None:
+        fetch = lambda bbox, time_interval, resolution: fetch_flood_mask(bbox, time_interval, resolution, run10.config)
+    else:
+        fetch = lambda bbox, time_interval, resolution: fetch_model_mask(flood_model, bbox, time_interval, resolution, run10.config)
+
+    async def warm(region):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                if "bbox" in region:
+                    await prewarm_area(run10, region, grid, fetch, risk_days)
+                else:
+                    await prewarm_gif(run10, region)
+            except Exception as e:
+                print(f"Failed to pre-warm {region_name(region)}: {e}")
+                return
+            print(f"Pre-warmed {region_name(region)} in {time.perf_counter() - start:.1f}s")
+
+    # Everything is warmed once at start-up, then each region on its own schedule
+    now = datetime.now()
+    schedule = [(now, index) for index in range(len(regions))]
+    try:
+        while schedule:
+            now = datetime.now()
+            due = []
+            while schedule and schedule[0][0] <= now:
+                due.append(heapq.heappop(schedule)[1])
+            await asyncio.gather(*(warm(regions[index]) for index in due))
+            if once:
+                break
+            for index in due:
+                heapq.heappush(schedule, (next_run(regions[index], datetime.now(), interval), index))
+            await asyncio.sleep(max((schedule[0][0] - datetime.now()).total_seconds(), 0))
+    finally:
+        run10.shutdown_render_pool()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-warm the flood caches for watched regions after each Sentinel-2 revisit")
+    parser.add_argument("--regions", required=True, help="JSON list of {lat, lon, radius_km} and/or {bbox} regions")
+    parser.add_argument("--interval", type=float, default=24 * 3600, help="seconds between runs for regions without an acquisition date")
+    parser.add_argument("--concurrency", type=int, default=PREWARM_CONCURRENCY)
+    parser.add_argument("--risk-days", type=int, default=ALERT_WINDOW_DAYS, help="risk grid window, as in risk_grid.py")
+    parser.add_argument("--no-risk-grid", action="store_true")
+    parser.add_argument("--once", action="store_true")
+    args = parser.parse_args()
+
+    with open(args.regions) as f:
+        regions = json.load(f)
+
+    grid = None
+    if not args.no_risk_grid:
+        from risk_grid import RiskGrid
+        grid = RiskGrid()
+
+    asyncio.run(prewarm(regions, args.interval, args.once, args.concurrency, grid, args.risk_days))
+
+
+if __name__ == "__main__":
+    main()
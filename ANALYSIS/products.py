@@ -0,0 +1,146 @@
+from sentinelhub import CRS, BBox, DataCollection, MimeType, SentinelHubRequest
+
+from fetcher import fetch_windows
+from indices import RAW_BANDS, compute_indices, split_bands
+from masks import PackedMask
+from sh_session import get_config_token_manager
+from tiling import mosaic_masks, split_bbox
+
+# Every product we know how to compute in an evalscript: input bands, output band
+# count, sample type and the JS expression producing the output array.
+PRODUCTS = {
+    "true_color": {
+        "bands": ["B02", "B03", "B04"],
+        "output_bands": 3,
+        "sample_type": "AUTO",
+        "expression": "[sample.B04, sample.B03, sample.B02]",
+    },
+    "evi": {
+        "bands": ["B02", "B04", "B08"],
+        "output_bands": 1,
+        "sample_type": "FLOAT32",
+        "expression": "[2.5 * (sample.B08 - sample.B04) / (sample.B08 + 6 * sample.B04 - 7.5 * sample.B02 + 1)]",
+    },
+    "ndmi": {
+        "bands": ["B08", "B11"],
+        "output_bands": 1,
+        "sample_type": "FLOAT32",
+        "expression": "[index(sample.B08, sample.B11)]",
+    },
+    "ndwi": {
+        "bands": ["B03", "B08"],
+        "output_bands": 1,
+        "sample_type": "FLOAT32",
+        "expression": "[index(sample.B03, sample.B08)]",
+    },
+    "flood": {
+        "bands": ["B02", "B03", "B08"],
+        "output_bands": 3,
+        "sample_type": "AUTO",
+        "expression": "[flood, flood, flood]",
+    },
+    # Raw reflectances plus dataMask, for computing indices locally (see indices.py)
+    "bands": {
+        "bands": RAW_BANDS + ["dataMask"],
+        "output_bands": len(RAW_BANDS) + 1,
+        "sample_type": "FLOAT32",
+        "expression": "[" + ", ".join(f"sample.{band}" for band in RAW_BANDS + ["dataMask"]) + "]",
+    },
+}
+
+EVALSCRIPT_TEMPLATE = """
+    //VERSION=3
+    function setup() {{
+        return {{
+            input: [{{ bands: {bands} }}],
+            output: [
+{outputs}
+            ]
+        }};
+    }}
+    function index(a, b) {{
+        return (a - b) / (a + b);
+    }}
+    function evaluatePixel(sample) {{
+        let flood = (index(sample.B03, sample.B08) > 0.005) && (index(sample.B08, sample.B02) > 0.005);
+        return {{
+{returns}
+        }};
+    }}
+"""
+
+
+def build_evalscript(products):
+    """One evalscript with a named output per requested product."""
+    unknown = set(products) - set(PRODUCTS)
+    if unknown:
+        raise ValueError(f"Unknown products: {sorted(unknown)}")
+
+    bands = sorted({band for name in products for band in PRODUCTS[name]["bands"]})
+    outputs = ",\n".join(
+        f'                {{ id: "{name}", bands: {PRODUCTS[name]["output_bands"]}, sampleType: "{PRODUCTS[name]["sample_type"]}" }}'
+        for name in products
+    )
+    returns = ",\n".join(f'            {name}: {PRODUCTS[name]["expression"]}' for name in products)
+    if "flood" not in products:
+        # Only compute the flood rule when it is actually returned
+        script = EVALSCRIPT_TEMPLATE.replace(
+            "        let flood = (index(sample.B03, sample.B08) > 0.005) && (index(sample.B08, sample.B02) > 0.005);\n", ""
+        )
+    else:
+        script = EVALSCRIPT_TEMPLATE
+    return script.format(bands=str(bands).replace("'", '"'), outputs=outputs, returns=returns)
+
+
+def fetch_products(bbox, size, time_interval, products, config, data_collection=DataCollection.SENTINEL2_L1C, local=False):
+    """Fetch any subset of PRODUCTS over one bbox and time range with a single Process API call.
+
+    Returns a dict mapping each product name to its array. With `local=True` only the
+    raw bands are downloaded and the products are computed with indices.py instead;
+    these come back as float reflectances / indices and a boolean flood mask.
+    """
+    products = list(dict.fromkeys(products))
+    if local:
+        return compute_indices(fetch_bands(bbox, size, time_interval, config, data_collection), products)
+
+    request = SentinelHubRequest(
+        evalscript=build_evalscript(products),
+        input_data=[SentinelHubRequest.input_data(
+            data_collection=data_collection,
+            time_interval=time_interval,
+        )],
+        responses=[SentinelHubRequest.output_response(name, MimeType.TIFF) for name in products],
+        bbox=bbox,
+        size=size,
+        config=config,
+    )
+
+    data = get_config_token_manager(config).get_data(request, config)[0]
+    if len(products) == 1:
+        # A single response is returned as a bare array rather than a tar archive
+        return {products[0]: data}
+    return {name: data[f"{name}.tif"] for name in products}
+
+
+def fetch_bands(bbox, size, time_interval, config, data_collection=DataCollection.SENTINEL2_L1C):
+    """Raw RAW_BANDS reflectances as a dict of float32 arrays, NaN where there is no data."""
+    stack = fetch_products(bbox, size, time_interval, ["bands"], config, data_collection)["bands"]
+    return split_bands(stack[..., :-1], data_mask=stack[..., -1])
+
+
+def fetch_flood_mask(bounding_box, time_interval, resolution, config, data_collection=DataCollection.SENTINEL2_L1C, max_concurrency=4):
+    """The flood product over a (west, south, east, north) bbox of any size, as a PackedMask.
+
+    Areas over the Process API size limit are fetched as concurrent tiles and mosaicked.
+    """
+    tiles, shape = split_bbox(bounding_box, resolution)
+
+    def fetch_tile(tile):
+        bbox = BBox(bbox=tile.bbox, crs=CRS.WGS84)
+        flood = fetch_products(bbox, tile.size, time_interval, ["flood"], config, data_collection)["flood"]
+        return PackedMask.from_bool(flood[..., 0] > 0)
+
+    results = fetch_windows(fetch_tile, tiles, max_concurrency=max_concurrency)
+    if all(result.error is not None for result in results):
+        raise results[0].error
+    return mosaic_masks(tiles, [result.value for result in results], shape)
@@ -0,0 +1,116 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+
+class RasterCache:
+    """Persistent cache of raw rasters stored as `.npy` files.
+
+    Entries survive restarts and are shared by every process pointing at the same
+    directory. Reads are memory-mapped, writes are atomic (temp file + rename), and
+    the least recently used entries are evicted once the directory exceeds `max_bytes`.
+    An entry's modification time is when it was written, its access time when it was
+    last read.
+    """
+
+    def __init__(self, directory, max_bytes=2 * 1024 ** 3):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        # Size counted for each entry, so overwriting a key only adds the difference
+        self._sizes = {path: size for path, size, _ in self._entries()}
+        self._bytes = sum(self._sizes.values())
+
+    @staticmethod
+    def make_key(bbox, time_interval, resolution, evalscript, *extra):
+        evalscript_hash = hashlib.sha1(evalscript.encode()).hexdigest()
+        key_input = f"{tuple(bbox)}_{tuple(time_interval)}_{resolution}_{evalscript_hash}_{extra}"
+        return hashlib.md5(key_input.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.npy")
+
+    def _entries(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(".npy"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((entry.path, stat.st_size, stat.st_atime))
+        return entries
+
+    def get(self, key, max_age=None):
+        """Return the cached array memory-mapped read-only, or None on a miss.
+
+        Entries written more than `max_age` seconds ago count as misses.
+        """
+        path = self._path(key)
+        try:
+            written = os.stat(path).st_mtime
+            if max_age is not None and time.time() - written > max_age:
+                raise FileNotFoundError(path)
+            array = np.load(path, mmap_mode="r")
+            # The atime is the LRU timestamp
+            os.utime(path, (time.time(), written))
+        except (FileNotFoundError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return array
+
+    def put(self, key, array):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, np.ascontiguousarray(array))
+            size = os.path.getsize(tmp_path)
+            path = self._path(key)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        with self._lock:
+            self._bytes += size - self._sizes.get(path, 0)
+            self._sizes[path] = size
+            if self._bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        self._sizes = {path: size for path, size, _ in entries}
+        for path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            del self._sizes[path]
+        self._bytes = total
+
+    def clear(self):
+        with self._lock:
+            for path, _, _ in self._entries():
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+            self._sizes = {}
+            self._bytes = 0
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "bytes": self._bytes, "max_bytes": self.max_bytes}
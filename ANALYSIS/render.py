@@ -0,0 +1,180 @@
+import os
+import tempfile
+import time
+from functools import lru_cache
+
+import numpy as np
+from PIL import GifImagePlugin, Image, ImageChops, ImageColor, ImageDraw, ImageFont
+
+# CPU-bound GIF rendering, kept free of Sentinel Hub setup so it can run in worker processes.
+#
+# The fade chain is composited with NumPy on uint8 frames rather than through a chain of
+# PIL Image.blend calls. It reproduces PIL bit for bit: labels are applied with PIL's
+# mask-paste rounding and blends use its float32 interpolation truncated to uint8.
+
+LABEL_POSITION = (100, 100)
+LABEL_INK = ImageColor.getcolor("#0000FF", "L")
+BLEND_BLOCK_BYTES = 256 * 1024
+
+
+def fade_weight(index):
+    return np.float32(1 - (1 - 0.1) ** (index + 1))
+
+
+@lru_cache(maxsize=8)
+def load_font(font_size):
+    return ImageFont.load_default(font_size)
+
+
+@lru_cache(maxsize=1024)
+def label_overlay(text, font_size):
+    """Coverage mask of `text` cropped to its bounding box, and the box's (top, left).
+
+    Each date label is rasterised once, into a small array, and reused for every frame
+    and request that shows it.
+    """
+    font = load_font(font_size)
+    left, top, right, bottom = ImageDraw.Draw(Image.new("L", (1, 1))).textbbox(LABEL_POSITION, text, font=font)
+    if right <= left or bottom <= top:
+        return None
+    mask = Image.new("L", (right - left, bottom - top))
+    ImageDraw.Draw(mask).text((LABEL_POSITION[0] - left, LABEL_POSITION[1] - top), text, font=font, fill=255)
+    return np.asarray(mask, dtype=np.uint32), (top, left)
+
+
+def draw_label(frame, text, font_size):
+    """Draw `text` onto a (H, W) uint8 frame in place, as ImageDraw.text would."""
+    overlay = label_overlay(text, font_size)
+    if overlay is None:
+        return frame
+    mask, (top, left) = overlay
+    height = min(mask.shape[0], frame.shape[0] - top)
+    width = min(mask.shape[1], frame.shape[1] - left)
+    if height <= 0 or width <= 0:
+        return frame
+    mask = mask[:height, :width]
+    region = frame[top:top + height, left:left + width]
+    # PIL's rounded x * a / 255 blend of the ink over the frame
+    blended = region * (255 - mask) + LABEL_INK * mask + 128
+    region[...] = ((blended >> 8) + blended) >> 8
+    return frame
+
+
+def to_frame(img, output_size=None):
+    """uint8 frame of a [0, 1] water image (array or PackedMask), i.e. (img * 255).astype(np.uint8)."""
+    img = np.asarray(img)
+    frame = np.multiply(img, 255, out=np.empty(img.shape, dtype=np.uint8), casting="unsafe")
+    if output_size:
+        return np.array(Image.fromarray(frame).resize(output_size))
+    return frame
+
+
+def blend_scratch(shape):
+    # Two float32 buffers for a block of rows; blending block by block keeps them in cache
+    rows = max(1, min(shape[0], BLEND_BLOCK_BYTES // (4 * max(1, shape[1]))))
+    return np.empty((2, rows, shape[1]), dtype=np.float32)
+
+
+def blend_into(previous, frame, weight, scratch):
+    """Replace uint8 `frame` with Image.blend(previous, frame, weight), in place."""
+    rows = scratch.shape[1]
+    for top in range(0, frame.shape[0], rows):
+        current = frame[top:top + rows]
+        block = scratch[0, :len(current)]
+        before = scratch[1, :len(current)]
+        before[...] = previous[top:top + rows]
+        block[...] = current
+        block -= before
+        block *= weight
+        block += before
+        current[...] = block
+    return frame
+
+
+class FrameFader:
+    """Labels each frame and blends it over the previous one, one frame at a time.
+
+    Frame i is frame i-1 blended towards labelled image i with weight 1 - 0.9 ** (i + 1).
+    The truncation after every blend makes each frame depend on the rounded previous
+    one, so there is no closed form; but only the previous blended frame is needed,
+    so frames can be produced as the water images arrive instead of materialising
+    the whole animation.
+    """
+
+    def __init__(self, font_size=20, output_size=None):
+        self.font_size = font_size
+        self.output_size = output_size
+        self.previous = None
+        self.scratch = None
+        self.index = 0
+
+    def add(self, img, text=""):
+        frame = draw_label(to_frame(img, self.output_size), text, self.font_size)
+        if self.previous is None:
+            self.scratch = blend_scratch(frame.shape)
+        else:
+            blend_into(self.previous, frame, fade_weight(self.index), self.scratch)
+        self.previous = frame
+        self.index += 1
+        return Image.fromarray(frame)
+
+
+class GifStreamEncoder:
+    """Encodes an animated GIF frame by frame.
+
+    `add_frame` returns the bytes to append for that frame (the GIF header comes with
+    the first one) and `finish` the trailer, so the output can be written to disk or
+    sent to a client progressively. Frames after the first are cropped to the region
+    that changed, like PIL's own multi-frame writer.
+    """
+
+    def __init__(self, duration=1000, loop=0):
+        self.duration = duration
+        self.loop = loop
+        self.previous = None
+
+    def add_frame(self, frame):
+        chunks = []
+        if self.previous is None:
+            header, _ = GifImagePlugin.getheader(frame.copy(), info={"loop": self.loop})
+            chunks.extend(header)
+            bbox = (0, 0) + frame.size
+        else:
+            # An unchanged frame still needs an entry to keep its display time
+            bbox = ImageChops.difference(self.previous, frame).getbbox() or (0, 0, 1, 1)
+        chunks.extend(GifImagePlugin.getdata(frame.crop(bbox), offset=bbox[:2], duration=self.duration))
+        self.previous = frame
+        return b"".join(chunks)
+
+    def finish(self):
+        return b";"
+
+
+def render_flood_gif(water_images, dates, filename, fade_steps=5, font_size=20):
+    """Blend the per-day water masks and encode them as a GIF at `filename`.
+
+    The GIF is written to a temporary file and renamed into place, so readers never
+    see a partially written file. Returns the seconds spent fading and encoding.
+    """
+    if not water_images:
+        raise ValueError("No frames to render")
+    fader = FrameFader(font_size)
+    encoder = GifStreamEncoder()
+    timings = {"fade": 0.0, "encode": 0.0}
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(filename) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            # Frames are faded and encoded one at a time, so only the previous frame is kept
+            for i, img in enumerate(water_images):
+                start = time.perf_counter()
+                frame = fader.add(img, dates[i] if i < len(dates) else "")
+                faded = time.perf_counter()
+                f.write(encoder.add_frame(frame))
+                timings["fade"] += faded - start
+                timings["encode"] += time.perf_counter() - faded
+            f.write(encoder.finish())
+        os.replace(tmp_path, filename)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return timings
@@ -0,0 +1,209 @@
+import argparse
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+from dotenv import load_dotenv
+
+# The RISK_GRID_* settings are read at import, so .env has to be in the environment first
+load_dotenv(dotenv_path=Path('.') / '.env')
+
+from alerts import ALERT_WINDOW_DAYS, danger_level, default_alert_interval
+
+# Precomputed flood risk over a fixed lat/lon grid, so /alert can answer from an indexed
+# on-disk table instead of downloading imagery per query. A background job (`main`)
+# refreshes every cell of the watched regions over the /alert default window; /alert
+# falls back to a live fetch when any cell under the query's radius is missing, stale,
+# from another window or computed by another flood method than the one it serves.
+
+RISK_GRID_PATH = os.getenv("RISK_GRID_PATH", "cache/risk_grid.sqlite")
+RISK_GRID_CELL_DEG = float(os.getenv("RISK_GRID_CELL_DEG", "0.05"))
+RISK_GRID_MAX_AGE = float(os.getenv("RISK_GRID_MAX_AGE", str(24 * 3600)))  # seconds
+
+# Method recorded for cells computed with the NDWI / NDVI rule; a flood model uses its tag
+FLOOD_RULE_METHOD = "ndwi-ndvi"
+
+
+def grid_method(flood_model):
+    return FLOOD_RULE_METHOD if flood_model is None else flood_model.tag
+
+
+def align_bbox(bounding_box, cell_deg):
+    """Grow (west, south, east, north) outwards to whole cells; returns the bbox and its cell extent."""
+    west, south, east, north = bounding_box
+    col0, col1 = math.floor(west / cell_deg), math.ceil(east / cell_deg)
+    row0, row1 = math.floor(south / cell_deg), math.ceil(north / cell_deg)
+    return (col0 * cell_deg, row0 * cell_deg, col1 * cell_deg, row1 * cell_deg), (row0, row1, col0, col1)
+
+
+def overlap_weights(bounding_box, cells, cell_deg):
+    """Area of `bounding_box` inside each cell of the extent `cells` (north row first), in degree^2 scaled by cos(lat)."""
+    west, south, east, north = bounding_box
+    row0, row1, col0, col1 = cells
+    rows = np.arange(row1 - 1, row0 - 1, -1)
+    cols = np.arange(col0, col1)
+    heights = np.clip(np.minimum(north, (rows + 1) * cell_deg) - np.maximum(south, rows * cell_deg), 0, None)
+    widths = np.clip(np.minimum(east, (cols + 1) * cell_deg) - np.maximum(west, cols * cell_deg), 0, None)
+    return np.outer(heights * np.cos(np.radians((rows + 0.5) * cell_deg)), widths)
+
+
+def cell_fractions(mask, cell_rows, cell_cols):
+    """Flooded fraction of each of `cell_rows` x `cell_cols` blocks of a PackedMask (row 0 = north).
+
+    Works through one band of cells at a time so the full mask is never unpacked at once.
+    """
+    height, width = mask.shape
+    row_edges = np.round(np.arange(cell_rows + 1) * height / cell_rows).astype(int)
+    col_edges = np.round(np.arange(cell_cols + 1) * width / cell_cols).astype(int)
+    fractions = np.zeros((cell_rows, cell_cols), dtype=np.float64)
+    for i in range(cell_rows):
+        y0, y1 = row_edges[i], row_edges[i + 1]
+        if y1 <= y0:
+            continue
+        band = np.unpackbits(mask.bits[y0:y1], axis=-1, count=width)
+        counts = np.add.reduceat(band.sum(axis=0, dtype=np.int64), col_edges[:-1])
+        areas = (y1 - y0) * np.diff(col_edges)
+        fractions[i] = np.divide(counts, areas, out=np.zeros(cell_cols), where=areas > 0)
+    return fractions
+
+
+class RiskGrid:
+    """SQLite table of per-cell flood fraction and danger level, keyed by (row, col).
+
+    Each thread gets its own connection; WAL mode lets the refresh job write while
+    the API keeps reading.
+    """
+
+    def __init__(self, path=RISK_GRID_PATH, cell_deg=RISK_GRID_CELL_DEG):
+        self.path = path
+        self.cell_deg = cell_deg
+        self._local = threading.local()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        db = self._db()
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        columns = [column[1] for column in db.execute("PRAGMA table_info(cells)")]
+        if columns and "method" not in columns:
+            # Cells from before methods were recorded can't be matched to one; the next refresh refills them
+            db.execute("DROP TABLE cells")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS cells ("
+            "row INTEGER, col INTEGER, fraction REAL, danger_level TEXT, "
+            "start_date TEXT, end_date TEXT, method TEXT, updated_at REAL, "
+            "PRIMARY KEY (row, col)) WITHOUT ROWID"
+        )
+        db.execute("INSERT OR IGNORE INTO meta VALUES ('cell_deg', ?)", (str(cell_deg),))
+        db.commit()
+        stored = float(db.execute("SELECT value FROM meta WHERE key = 'cell_deg'").fetchone()[0])
+        if stored != cell_deg:
+            raise ValueError(f"{path} holds a {stored} degree grid, not {cell_deg}")
+
+    def _db(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self.path)
+        return db
+
+    def lookup(self, bounding_box, time_interval, method, max_age=RISK_GRID_MAX_AGE):
+        """Flood risk over (west, south, east, north) from the cells it touches, or None.
+
+        Returns a dict with the area-weighted "flooded_fraction", its "danger_level" and
+        the "cell_fractions" (north row first). None unless every cell was computed for
+        `time_interval` by `method` within `max_age` seconds.
+        """
+        _, cells = align_bbox(bounding_box, self.cell_deg)
+        row0, row1, col0, col1 = cells
+        found = self._db().execute(
+            "SELECT row, col, fraction FROM cells WHERE row >= ? AND row < ? AND col >= ? AND col < ? "
+            "AND start_date = ? AND end_date = ? AND method = ? AND updated_at >= ?",
+            (row0, row1, col0, col1, time_interval[0], time_interval[1], method,
+             -math.inf if max_age is None else time.time() - max_age),
+        ).fetchall()
+        if len(found) != (row1 - row0) * (col1 - col0):
+            return None
+        fractions = np.empty((row1 - row0, col1 - col0))
+        for row, col, fraction in found:
+            fractions[row1 - 1 - row, col - col0] = fraction
+        weights = overlap_weights(bounding_box, cells, self.cell_deg)
+        flooded = float((fractions * weights).sum() / weights.sum())
+        return {"flooded_fraction": flooded, "danger_level": danger_level(flooded), "cell_fractions": fractions}
+
+    def update(self, cells, fractions, time_interval, method):
+        """Store `fractions` (north row first) for the cell extent `cells` = (row0, row1, col0, col1)."""
+        row0, row1, col0, col1 = cells
+        now = time.time()
+        records = [
+            (row1 - 1 - i, col0 + j, float(fraction), danger_level(fraction), time_interval[0], time_interval[1], method, now)
+            for (i, j), fraction in np.ndenumerate(fractions)
+        ]
+        db = self._db()
+        db.executemany("INSERT OR REPLACE INTO cells VALUES (?, ?, ?, ?, ?, ?, ?, ?)", records)
+        db.commit()
+        return len(records)
+
+
+def refresh_region(grid, bounding_box, time_interval, fetch_flood_mask, method, resolution=60):
+    """Recompute every cell of one region from a single (tiled) flood mask over it.
+
+    `fetch_flood_mask(bounding_box, time_interval, resolution)` returns a PackedMask
+    computed by `method` (see `grid_method`).
+    """
+    aligned, cells = align_bbox(bounding_box, grid.cell_deg)
+    row0, row1, col0, col1 = cells
+    mask = fetch_flood_mask(aligned, time_interval, resolution)
+    return grid.update(cells, cell_fractions(mask, row1 - row0, col1 - col0), time_interval, method)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Refresh the precomputed flood risk grid for the watched regions")
+    parser.add_argument("--regions", required=True, help='JSON file: [{"name": ..., "bbox": [west, south, east, north]}, ...]')
+    parser.add_argument("--days", type=int, default=ALERT_WINDOW_DAYS, help="length of the time window ending today")
+    parser.add_argument("--resolution", type=int, default=60)
+    parser.add_argument("--interval", type=float, default=6 * 3600, help="seconds between refreshes")
+    parser.add_argument("--once", action="store_true")
+    args = parser.parse_args()
+
+    from sentinelhub import SHConfig
+
+    from flood_model import fetch_model_mask, get_flood_model
+    from products import fetch_flood_mask
+
+    config = SHConfig()
+    if not config.sh_client_id or not config.sh_client_secret:
+        raise Exception("Please provide the Sentinel Hub credentials in the .env file.")
+
+    with open(args.regions) as f:
+        regions = json.load(f)
+    grid = RiskGrid()
+
+    # Cells are computed the way /alert computes a live answer, and tagged so it only uses matching ones
+    flood_model = get_flood_model()
+    if flood_model is None:
+        fetch = lambda bbox, interval, resolution: fetch_flood_mask(bbox, interval, resolution, config)
+    else:
+        fetch = lambda bbox, interval, resolution: fetch_model_mask(flood_model, bbox, interval, resolution, config)
+
+    while True:
+        time_interval = default_alert_interval(args.days)
+        for region in regions:
+            start = time.perf_counter()
+            try:
+                count = refresh_region(grid, region["bbox"], time_interval, fetch, grid_method(flood_model), args.resolution)
+            except Exception as e:
+                print(f"Failed to refresh {region.get('name', region['bbox'])}: {e}")
+                continue
+            print(f"Refreshed {count} cells of {region.get('name', region['bbox'])} in {time.perf_counter() - start:.1f}s")
+        if args.once:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,6 @@
-import requests
-import base64
 from PIL import Image
 import io
+import tarfile
 import datetime
 import os
 # env
@@ -9,6 +8,9 @@ from dotenv import load_dotenv
 from pathlib import Path
 import matplotlib.pyplot as plt
 
+from products import build_evalscript
+from sh_session import get_token_manager
+
 
 env_loc = Path('.') / '.env'
 load_dotenv(dotenv_path=env_loc)
@@ -19,26 +21,16 @@ CLIENT_SECRET = os.environ["CLIENT_SECRET"]
 
 # Function to obtain access token
 def get_access_token(client_id, client_secret):
-    """Fetch access token from Sentinel Hub API."""
-    auth_string = f"{client_id}:{client_secret}"
-    base64_auth = base64.b64encode(auth_string.encode()).decode()
-
-    headers = {
-        "Content-Type": "application/x-www-form-urlencoded",
-        "Authorization": f"Basic {base64_auth}"
-    }
-
-    payload = {"grant_type": "client_credentials"}
-
-    response = requests.post("https://services.sentinel-hub.com/oauth/token", data=payload, headers=headers)
-    if response.status_code == 200:
-        return response.json().get("access_token")
-    else:
-        raise Exception(f"Failed to retrieve access token: {response.json()}")
+    """Fetch access token from Sentinel Hub API (cached and refreshed by the shared token manager)."""
+    return get_token_manager(client_id, client_secret).access_token
 
 # Function to fetch image from Sentinel Hub API
-def fetch_image(evalscript, bbox, date_from, date_to, access_token):
-    """Fetch image from Sentinel Hub based on evalscript and date range."""
+def fetch_image(evalscript, bbox, date_from, date_to, access_token, outputs=None):
+    """Fetch image from Sentinel Hub based on evalscript and date range.
+
+    With `outputs` (names of the evalscript's outputs) all of them are returned from
+    one request as a dict of images instead of a single image.
+    """
     headers = {
         "Authorization": f"Bearer {access_token}",
         "Content-Type": "application/json"
@@ -63,12 +55,25 @@ def fetch_image(evalscript, bbox, date_from, date_to, access_token):
         "output": {"width": 512, "height": 512},
         "evalscript": evalscript
     }
+    if outputs:
+        payload["output"]["responses"] = [
+            {"identifier": name, "format": {"type": "image/tiff"}} for name in outputs
+        ]
+        headers["Accept"] = "application/tar"
 
     from pprint import pprint
     pprint(payload)
-    response = requests.post("https://services.sentinel-hub.com/api/v1/process", headers=headers, json=payload)
+    # Pooled keep-alive session shared with the token manager
+    http = get_token_manager(CLIENT_ID, CLIENT_SECRET).http
+    response = http.post("https://services.sentinel-hub.com/api/v1/process", headers=headers, json=payload)
 
-    if response.status_code == 200:
+    if response.status_code == 200 and outputs:
+        with tarfile.open(fileobj=io.BytesIO(response.content)) as tar:
+            return {
+                name: Image.open(io.BytesIO(tar.extractfile(f"{name}.tif").read()))
+                for name in outputs
+            }
+    elif response.status_code == 200:
         breakpoint()
         return Image.open(io.BytesIO(response.content))
     else:
@@ -88,55 +93,12 @@ def get_live_images_based_on_location(lat, lon, date, time):
     padding = 0.1       # Padding for bbox
     bbox = [lon - padding, lat - padding, lon + padding, lat + padding]  # Adjust bbox size if needed
 
-    # Define evalscripts for each image type
-    true_color_evalscript = """
-        // VERSION=3
-        function setup() {
-            return {
-                input: ["B02", "B03", "B04"],
-                output: { bands: 3 }
-            };
-        }
-
-        function evaluatePixel(sample) {
-            return [sample.B04, sample.B03, sample.B02];
-        }
-    """
-
-    evi_evalscript = """
-        // VERSION=3
-        function setup() {
-            return {
-                input: ["B04", "B08", "B02"],
-                output: { bands: 1 }
-            };
-        }
-
-        function evaluatePixel(sample) {
-            let EVI = 2.5 * (sample.B08 - sample.B04) / (sample.B08 + 6 * sample.B04 - 7.5 * sample.B02 + 1);
-            return [EVI];
-        }
-    """
-
-    ndmi_evalscript = """
-        // VERSION=3
-        function setup() {
-            return {
-                input: ["B08", "B11"],
-                output: { bands: 1 }
-            };
-        }
-
-        function evaluatePixel(sample) {
-            let NDMI = (sample.B08 - sample.B11) / (sample.B08 + sample.B11);
-            return [NDMI];
-        }
-    """
-
-    # Fetch images
-    true_color_image = fetch_image(true_color_evalscript, bbox, date_from, date_to, access_token)
-    evi_image = fetch_image(evi_evalscript, bbox, date_from, date_to, access_token)
-    ndmi_image = fetch_image(ndmi_evalscript, bbox, date_from, date_to, access_token)
+    # One evalscript with a named output per image type, fetched in a single request
+    outputs = ["true_color", "evi", "ndmi"]
+    images = fetch_image(build_evalscript(outputs), bbox, date_from, date_to, access_token, outputs=outputs)
+    true_color_image = images["true_color"]
+    evi_image = images["evi"]
+    ndmi_image = images["ndmi"]
 
     # Display images
     # true_color_image.show(title="True Color")
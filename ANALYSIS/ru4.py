@@ -1,4 +1,5 @@
 from sentinelhub import SHConfig
+from sh_session import get_config_token_manager
 from dotenv import load_dotenv
 from pathlib import Path
 import os
@@ -11,6 +12,9 @@ config = SHConfig()
 if not config.sh_client_id or not config.sh_client_secret:
     print("Warning! To use Process API, please provide the credentials (OAuth client ID and client secret).")
 
+# One cached OAuth token and pooled HTTP session for every request in the process
+token_manager = get_config_token_manager(config)
+
 import datetime
 import os
 
@@ -31,6 +35,26 @@ from sentinelhub import (
 
 # The following is not a package. It is a file utils.py which should be in the same folder as this notebook.
 from utils import plot_image
+from fetcher import fetch_windows
+from products import fetch_bands, fetch_flood_mask, fetch_products
+from tiling import mosaic, split_bbox
+from raster_cache import RasterCache
+from gif_cache import max_age_for
+from masks import PackedMask
+from alerts import default_alert_interval, point_bbox, score_flood, score_points
+from risk_grid import RiskGrid, grid_method
+from flood_model import fetch_model_mask, get_flood_model, spectral_features
+
+# Shares the on-disk raster cache with the /flood_gif/ service (run10.py)
+raster_cache = RasterCache(
+    os.getenv("RASTER_CACHE_DIR", "cache/rasters"),
+    max_bytes=int(os.getenv("RASTER_CACHE_MAX_BYTES") or 2 * 1024 ** 3),
+)
+
+FETCH_CONCURRENCY = int(os.getenv("FETCH_CONCURRENCY", "4"))
+
+# Learned flood model (flood_model.py), loaded once; None keeps the NDWI/NDVI rule
+flood_model = get_flood_model()
 
 # betsiboka_coords_wgs84 = (46.16, -16.15, 46.51, -15.58)
 AP_coords_wgs84 = (76.75, 12.61, 84.81, 19.92)
@@ -41,50 +65,25 @@ TIME_INTERVAL = ("2024-05-26", "2024-05-28")
 
 resolution = 150
 
-betsiboka_bbox = BBox(bbox=AP_coords_wgs84, crs=CRS.WGS84)
-betsiboka_size = bbox_to_dimensions(betsiboka_bbox, resolution=resolution)
-
-print(f"Image shape at {resolution} m resolution: {betsiboka_size} pixels")
-
-evalscript_true_color = """
-    //VERSION=3
-
-    function setup() {
-        return {
-            input: [{
-                bands: ["B02", "B03", "B04"]
-            }],
-            output: {
-                bands: 3
-            }
-        };
-    }
-
-    function evaluatePixel(sample) {
-        return [sample.B04, sample.B03, sample.B02];
-    }
-"""
-
-request_true_color = SentinelHubRequest(
-    evalscript=evalscript_true_color,
-    input_data=[
-        SentinelHubRequest.input_data(
-            data_collection=DataCollection.SENTINEL2_L1C,
-            time_interval=TIME_INTERVAL,
-        )
-    ],
-    responses=[SentinelHubRequest.output_response("default", MimeType.PNG)],
-    bbox=betsiboka_bbox,
-    size=betsiboka_size,
-    config=config,
-)
+# Areas over the 2500 px request limit (e.g. the whole of Andhra Pradesh) are fetched
+# as a grid of tiles, concurrently, and mosaicked back into one image per product
+PRODUCT_NAMES = ["true_color", "evi", "ndmi", "flood"]
+tiles, betsiboka_shape = split_bbox(AP_coords_wgs84, resolution)
 
-true_color_imgs = request_true_color.get_data()
+print(f"Image shape at {resolution} m resolution: {betsiboka_shape[::-1]} pixels in {len(tiles)} tiles")
 
-print(f"Returned data is of type = {type(true_color_imgs)} and length {len(true_color_imgs)}.")
-print(f"Single element in the list is of type {type(true_color_imgs[-1])} and has shape {true_color_imgs[-1].shape}")
+# True color, EVI, NDMI and flood detection from a single Process API request per tile
+tile_results = fetch_windows(
+    lambda tile: fetch_products(BBox(bbox=tile.bbox, crs=CRS.WGS84), tile.size, TIME_INTERVAL, PRODUCT_NAMES, config),
+    tiles, max_concurrency=FETCH_CONCURRENCY,
+)
+images = {
+    name: mosaic(tiles, [result.value[name] if result.error is None else None for result in tile_results], betsiboka_shape)
+    for name in PRODUCT_NAMES
+}
+print(f"Returned products: {list(images)}")
 
-image = true_color_imgs[0]
+image = images["true_color"]
 print(f"Image type: {image.dtype}")
 
 # plot function
@@ -93,138 +92,35 @@ print(f"Image type: {image.dtype}")
 plot_image(image, factor=3.5 / 255, clip_range=(0, 1), image_type='true_color')
 
 # EVI
-evalscript_evi = """
-    //VERSION=3
-
-    function setup() {
-        return {
-            input: [{
-                bands: ["B04", "B08", "B02"]
-            }],
-            output: {
-                bands: 1
-            }
-        };
-    }
-
-    function evaluatePixel(sample) {
-        let denom = sample.B08 + sample.B04;
-        denom = denom == 0 ? 0.0001 : denom; // to prevent division by zero
-        let evi = 2.5 * (sample.B08 - sample.B04) / denom;
-        return [evi];
-    }
-"""
-
-request_evi = SentinelHubRequest(
-    evalscript=evalscript_evi,
-    input_data=[
-        SentinelHubRequest.input_data(
-            data_collection=DataCollection.SENTINEL2_L1C,
-            time_interval=TIME_INTERVAL,
-        )
-    ],
-    responses=[SentinelHubRequest.output_response("default", MimeType.TIFF)],
-    bbox=betsiboka_bbox,
-    size=betsiboka_size,
-    config=config,
-)
-
-evi_imgs = request_evi.get_data()
-
-print(f"Returned data is of type = {type(evi_imgs)} and length {len(evi_imgs)}.")
-print(f"Single element in the list is of type {type(evi_imgs[-1])} and has shape {evi_imgs[-1].shape}")
-
-evi = evi_imgs[0][:, :]
+evi = images["evi"]
 print(f"Image type: {evi.dtype}")
-
 plot_image(evi, factor=3.5, clip_range=(-1, 1), image_type='evi')
 
 # NDMI
-
-evalscript_ndmi = """
-    //VERSION=3
-    function setup() {
-        return {
-            input: [{ bands: ["B08", "B11"] }],
-            output: { bands: 1 }
-        };
-    }
-    function evaluatePixel(sample) {
-        let ndmi = (sample.B08 - sample.B11) / (sample.B08 + sample.B11);
-        return [ndmi];
-    }
-"""
-
-# Create and execute the request for NDMI
-request_ndmi = SentinelHubRequest(
-    evalscript=evalscript_ndmi,
-    input_data=[SentinelHubRequest.input_data(
-        data_collection=DataCollection.SENTINEL2_L1C,
-        time_interval=TIME_INTERVAL,
-    )],
-    responses=[SentinelHubRequest.output_response("default", MimeType.TIFF)],
-    bbox=betsiboka_bbox,
-    size=betsiboka_size,
-    config=config,
-)
-
-ndmi_imgs = request_ndmi.get_data()
-print(f"Returned data is of type = {type(ndmi_imgs)} and length {len(ndmi_imgs)}.")
-print(f"Single element in the list is of type {type(ndmi_imgs[-1])} and has shape {ndmi_imgs[-1].shape}")
-
-# Display NDMI image
-ndmi = ndmi_imgs[0][:, :]
+ndmi = images["ndmi"]
 print(f"Image type: {ndmi.dtype}")
 plot_image(ndmi, factor=3.5, clip_range=(-1, 1), image_type='ndmi')
 
-
 # FLood detection
-evalscript_flood = """
-    //VERSION=3
-    function setup() {
-        return {
-            input: [{ bands: ["B03", "B08", "B02"] }],
-            output: { bands: 3 }
-        };
-    }
-    function evaluatePixel(sample) {
-        let ndwi = (sample.B03 - sample.B08) / (sample.B03 + sample.B08);
-        let ndvi = (sample.B08 - sample.B02) / (sample.B08 + sample.B02);
-        let flood = (ndwi > 0.005) && (ndvi > 0.005);
-        return [flood, flood, flood];
-    }
-"""
-
-# Create and execute the request for flood detection
-request_flood = SentinelHubRequest(
-    evalscript=evalscript_flood,
-    input_data=[SentinelHubRequest.input_data(
-        data_collection=DataCollection.SENTINEL2_L1C,
-        time_interval=TIME_INTERVAL,
-    )],
-    responses=[SentinelHubRequest.output_response("default", MimeType.PNG)],
-    bbox=betsiboka_bbox,
-    size=betsiboka_size,
-    config=config,
-)
-
-flood_imgs = request_flood.get_data()
-print(f"Returned data is of type = {type(flood_imgs)} and length {len(flood_imgs)}.")
-print(f"Single element in the list is of type {type(flood_imgs[-1])} and has shape {flood_imgs[-1].shape}")
-
-# Display flood detection image
-flood = flood_imgs[0]
+flood = images["flood"]
 print(f"Image type: {flood.dtype}")
 plot_image(flood, factor=3.5, clip_range=(0, 1), image_type='flood_detection')
 
 
-from flask import Flask, request, jsonify
+import json
+
+from flask import Flask, Response, request, jsonify, stream_with_context
 
 app = Flask(__name__)
 
+# Flood fraction per grid cell, refreshed in the background by risk_grid.py
+risk_grid = RiskGrid()
+
 def get_new_flood_hazard_info(lat, lon, radius_km=25, time_interval=TIME_INTERVAL, resolution=60, show=False, tot=0.5):
     """Get new flood hazard information"""
-    bbox = BBox(bbox=(lat, lon, lat, lon), crs=CRS.WGS84)
+    # The same area the risk grid and /alert/batch score: everything within radius_km of the point
+    bounding_box = tuple(point_bbox(lat, lon, radius_km))
+    bbox = BBox(bbox=bounding_box, crs=CRS.WGS84)
     size = bbox_to_dimensions(bbox, resolution=resolution)
 
     evalscript_flood = """
@@ -255,11 +151,26 @@ def get_new_flood_hazard_info(lat, lon, radius_km=25, time_interval=TIME_INTERVA
         config=config,
     )
 
-    flood_imgs = request_flood.get_data()
+    # The three bands carry the same 0/255 flag, so only one bit per pixel is kept
+    if flood_model is None:
+        cache_key = raster_cache.make_key(bounding_box, time_interval, resolution, evalscript_flood, "packed")
+    else:
+        cache_key = raster_cache.make_key(bounding_box, time_interval, resolution, flood_model.tag, "packed")
+    # A window reaching into the last day is fetched again once its entry is old
+    buffer = raster_cache.get(cache_key, max_age=max_age_for(time_interval))
+    if buffer is None:
+        if flood_model is None:
+            flood_imgs = token_manager.get_data(request_flood, config)
+            flood = PackedMask.from_bool(flood_imgs[0][..., 0] > 0)
+        else:
+            bands = fetch_bands(bbox, size, time_interval, config)
+            flood = flood_model.flood_mask(spectral_features(bands, flood_model.feature_names))
+        raster_cache.put(cache_key, flood.to_buffer())
+    else:
+        flood = PackedMask.from_buffer(buffer)
 
-    flood = flood_imgs[0]
     if show:
-        plot_image(flood, factor=3.5, clip_range=(0, 1), image_type='flood_detection')
+        plot_image(flood.to_bool(), factor=3.5, clip_range=(0, 1), image_type='flood_detection')
 
     return flood
 
@@ -270,36 +181,74 @@ def alert():
     lat = data['lat']
     lon = data['lon']
     radius_km = data.get('radius_km', 25)
-    time_interval = data.get('time_interval', TIME_INTERVAL)
+    # the last 10 days up to today, the window the risk grid is refreshed for
+    time_interval = data.get('time_interval') or default_alert_interval()
     resolution = data.get('resolution', 60)
     show = data.get('show', False)
     tot = data.get('tot', 0.5)
 
-    flood = get_new_flood_hazard_info(lat, lon, radius_km, time_interval, resolution, show, tot)
+    # Areas inside the watched regions are answered from the precomputed grid when it holds this window
+    cells = None
+    if not data.get('live', False):
+        cells = risk_grid.lookup(point_bbox(lat, lon, radius_km), tuple(time_interval), grid_method(flood_model))
 
-    # if 10% of the image is flooded then return high danger level
-    if np.sum(flood) > 0.4 * flood.size:
-        danger_level = 'high'
-    if np.sum(flood) > 0.1 * flood.size:
-        danger_level = 'moderate'
+    if cells is None:
+        flood = get_new_flood_hazard_info(lat, lon, radius_km, time_interval, resolution, show, tot)
+        # high above 40% flooded, moderate above 10%
+        danger_level, _ = score_flood(flood)
+        image = flood.to_bool().astype(np.uint8) * 255
     else:
-        danger_level = 'low'
+        danger_level = cells['danger_level']
+        # One pixel per grid cell, from 0 (dry) to 255 (fully flooded)
+        image = np.round(cells['cell_fractions'] * 255).astype(np.uint8)
     # return danger level and base64 image
     from PIL import Image
     import io
     import base64
 
-    img = Image.fromarray((flood * 255).astype(np.uint8))
+    img = Image.fromarray(image)
     rawBytes = io.BytesIO()
     img.save(rawBytes, "PNG")
     rawBytes.seek(0)
-    img_base64 = base64.b64encode(rawBytes.read())
+    img_base64 = base64.b64encode(rawBytes.read()).decode("ascii")
 
     return jsonify({
         'danger_level': danger_level,
         'image': img_base64
     })
 
+@app.route('/alert/batch', methods=['POST'])
+def alert_batch():
+    """Score many {lat, lon, radius_km} points; results stream back as NDJSON, one line per point"""
+    data = request.get_json()
+    points = data['points']
+    time_interval = tuple(data.get('time_interval') or default_alert_interval())
+    resolution = data.get('resolution', 60)
+    use_grid = not data.get('live', False)
+    method = grid_method(flood_model)
+
+    def generate():
+        live = []
+        for index, point in enumerate(points):
+            cells = None
+            if use_grid:
+                cells = risk_grid.lookup(point_bbox(point['lat'], point['lon'], point.get('radius_km', 25)), time_interval, method)
+            if cells is None:
+                live.append(index)
+            else:
+                yield json.dumps({'index': index, 'danger_level': cells['danger_level'], 'flooded_fraction': cells['flooded_fraction']}) + '\n'
+
+        # Nearby points share one flood mask fetch; each line carries the point's input index
+        if flood_model is None:
+            fetch = lambda bbox: fetch_flood_mask(bbox, time_interval, resolution, config)
+        else:
+            fetch = lambda bbox: fetch_model_mask(flood_model, bbox, time_interval, resolution, config)
+        for result in score_points([points[i] for i in live], fetch, max_concurrency=FETCH_CONCURRENCY):
+            result['index'] = live[result['index']]
+            yield json.dumps(result) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
 if __name__ == '__main__':
     app.run(debug=True)
     # testing
\ No newline at end of file
@@ -4,10 +4,13 @@ import matplotlib.pyplot as plt
 from dotenv import load_dotenv
 from pathlib import Path
 from sentinelhub import SHConfig, SentinelHubRequest, DataCollection, bbox_to_dimensions, CRS, BBox, MimeType
-from geopy.distance import great_circle
 from datetime import datetime, timedelta
 from PIL import Image, ImageDraw, ImageFont
 
+from geodesy import point_bboxes
+from masks import PackedMask
+from sh_session import get_config_token_manager
+
 # Load environment variables
 env_loc = Path('.') / '.env'
 load_dotenv(dotenv_path=env_loc)
@@ -17,12 +20,11 @@ config = SHConfig()
 if not config.sh_client_id or not config.sh_client_secret:
     print("Warning! To use Process API, please provide the credentials (OAuth client ID and client secret).")
 
+# One cached OAuth token and pooled HTTP session for every request in the process
+token_manager = get_config_token_manager(config)
+
 def calculate_bounding_box(lat, lon, radius_km):
-    north = great_circle(kilometers=radius_km).destination((lat, lon), 0)  # North
-    south = great_circle(kilometers=radius_km).destination((lat, lon), 180)  # South
-    east = great_circle(kilometers=radius_km).destination((lat, lon), 90)  # East
-    west = great_circle(kilometers=radius_km).destination((lat, lon), 270)  # West
-    return [west.longitude, south.latitude, east.longitude, north.latitude]
+    return point_bboxes(lat, lon, radius_km).tolist()
 
 def detect_flooding(lat, lon, radius_km, time_interval, resolution=60, show=False, tot=0.5):
     """ Detect flooding in a given area using Sentinel-2 imagery. """
@@ -57,12 +59,9 @@ def detect_flooding(lat, lon, radius_km, time_interval, resolution=60, show=Fals
         config=config,
     )
 
-    response = request_ndmi.get_data()
+    response = token_manager.get_data(request_ndmi, config)
     ndmi_data = response[0]
-    water_mask = ndmi_data > (tot * 255)
-
-    water_image = np.zeros(ndmi_data.shape, dtype=np.float32)
-    water_image[water_mask] = 1
+    water_image = PackedMask.from_bool(ndmi_data > (tot * 255))
 
     if show:
         plt.imshow(ndmi_data, cmap='gray')
@@ -70,7 +69,7 @@ def detect_flooding(lat, lon, radius_km, time_interval, resolution=60, show=Fals
         plt.title('Flooding Image')
         plt.show()
 
-        plt.imshow(water_image, cmap='Blues')
+        plt.imshow(water_image.to_bool(), cmap='Blues')
         plt.axis('off')
         plt.title('Identified Water Areas')
         plt.show()
@@ -100,7 +99,7 @@ def add_text_with_fade(images, texts, fade_steps=10, font_size=20, output_size=N
     font = ImageFont.load_default() if not font_size else ImageFont.truetype("arial.ttf", font_size)
 
     for i, img in enumerate(images):
-        img = Image.fromarray((img * 255).astype(np.uint8))
+        img = Image.fromarray((np.asarray(img, dtype=np.float32) * 255).astype(np.uint8))
         if output_size:
             img = img.resize(output_size)
 
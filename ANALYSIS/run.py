@@ -1,19 +1,14 @@
 from pathlib import Path
-import h5py
 import matplotlib.pyplot as plt
 import numpy as np
 import imageio
 import os
 
-# Function to read subdataset from HDF file
-def read_hdf_subdataset(hdf_file, subdataset_name):
-    # with h5py.File(hdf_file, 'r') as hdf:
-    #     data = hdf[subdataset_name][:]
-    # return data
-    f = h5py.File(hdf_file, 'r')
-    data = f[subdataset_name][:]
-    f.close()
-    return data
+from hdf_access import open_tile
+
+# Function to read subdataset from HDF file (HDF4-EOS or HDF5); the tile stays open for the next subdataset
+def read_hdf_subdataset(hdf_file, subdataset_name, window=None):
+    return open_tile(hdf_file).read(subdataset_name, window)
 
 # HDF file path
 hdf_file_path = Path('../database/earthdata/MCDWD_L3_NRT.A2024300.h35v13.061.hdf').resolve()
@@ -2,59 +2,259 @@ import os
 import numpy as np
 from dotenv import load_dotenv
 from pathlib import Path
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from sentinelhub import SHConfig, SentinelHubRequest, DataCollection, bbox_to_dimensions, CRS, BBox, MimeType
-from geopy.distance import great_circle
 from datetime import datetime, timedelta
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image
+from collections import deque
 from functools import lru_cache
-import hashlib
-import os
+from concurrent.futures import ProcessPoolExecutor
+import asyncio
+import multiprocessing
+import io
+import tempfile
+from contextlib import aclosing
 
-# Load environment variables
+# Load environment variables before the local modules below read their settings from them
 env_loc = Path('.') / '.env'
 load_dotenv(dotenv_path=env_loc)
 
+import metrics
+from fetcher import FetchResult, RateLimiter, fetch_windows, iter_fetch_windows_async
+from flood_model import get_flood_model, spectral_features
+from geodesy import point_bboxes
+from gif_cache import GifCache, max_age_for
+from indices import split_bands
+from masks import PackedMask
+from raster_cache import RasterCache
+from render import FrameFader, GifStreamEncoder, render_flood_gif
+from sh_session import get_config_token_manager
+from singleflight import AsyncSingleFlight, AsyncStreamFlight, SingleFlight
+from snapping import SNAP_TILE_PIXELS, covering_tiles, crop_tiles, snap_point
+from tiling import mosaic_masks, split_bbox, threshold_tile
+
 # Configure Sentinel Hub
 config = SHConfig()
 if not config.sh_client_id or not config.sh_client_secret:
     raise Exception("Please provide the Sentinel Hub credentials in the .env file.")
 
+# One cached OAuth token and pooled HTTP session for every request in the process
+token_manager = get_config_token_manager(config)
+
+# Concurrent per-window fetches against the Process API
+FETCH_CONCURRENCY = int(os.getenv("FETCH_CONCURRENCY", "4"))
+FETCH_RATE_LIMIT = float(os.getenv("FETCH_RATE_LIMIT", "0"))  # requests per second, 0 disables the limit
+rate_limiter = RateLimiter(FETCH_RATE_LIMIT) if FETCH_RATE_LIMIT > 0 else None
+# Streamed GIFs fetch their days as multi-temporal requests of this many days, a couple of
+# requests ahead of the frames being sent, so memory does not grow with the date range
+STREAM_CHUNK_DAYS = int(os.getenv("STREAM_CHUNK_DAYS") or 7)
+STREAM_CHUNKS_AHEAD = 2
+
+# Fading and GIF encoding are CPU bound, so they run outside the event loop's process;
+# an empty RENDER_WORKERS (as in .env.sample) means one worker per CPU
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS") or os.cpu_count() or 1)
+render_pool = None
+
+# Overridable so benchmarks can point requests at a fake Sentinel Hub
+DATA_COLLECTION = DataCollection.SENTINEL2_L1C
+
+# Day-level NDMI rasters persisted on disk and shared by all workers
+RASTER_CACHE_DIR = os.getenv("RASTER_CACHE_DIR", "cache/rasters")
+RASTER_CACHE_MAX_BYTES = int(os.getenv("RASTER_CACHE_MAX_BYTES") or 2 * 1024 ** 3)
+raster_cache = RasterCache(RASTER_CACHE_DIR, max_bytes=RASTER_CACHE_MAX_BYTES)
+
+# Rendered GIFs, expired by how recent their dates are (see gif_cache.py)
+gif_cache = GifCache()
+
+EVALSCRIPT_NDMI = """
+    //VERSION=3
+    function setup() {
+        return {
+            input: [{ bands: ["B08", "B11"] }],
+            output: { bands: 1 }
+        };
+    }
+    function evaluatePixel(sample) {
+        let ndmi = (sample.B08 - sample.B11) / (sample.B08 + sample.B11);
+        return [ndmi];
+    }
+"""
+
+# Same index plus dataMask, so single-day rasters can be mosaicked locally
+EVALSCRIPT_NDMI_MASKED = """
+    //VERSION=3
+    function setup() {
+        return {
+            input: [{ bands: ["B08", "B11", "dataMask"] }],
+            output: { bands: 2 }
+        };
+    }
+    function evaluatePixel(sample) {
+        let ndmi = (sample.B08 - sample.B11) / (sample.B08 + sample.B11);
+        return [ndmi, sample.dataMask];
+    }
+"""
+
+# Raw reflectances plus dataMask, for the learned flood model
+EVALSCRIPT_BANDS_MASKED = """
+    //VERSION=3
+    function setup() {
+        return {
+            input: [{ bands: ["B02", "B03", "B04", "B08", "B11", "dataMask"] }],
+            output: { bands: 6, sampleType: "FLOAT32" }
+        };
+    }
+    function evaluatePixel(sample) {
+        return [sample.B02, sample.B03, sample.B04, sample.B08, sample.B11, sample.dataMask];
+    }
+"""
+
+# Multi-temporal versions of the two above: one request returns the (values..., dataMask)
+# of every acquisition in its time range, most recent first, with the acquisition dates
+# as userdata, so a GIF's days come from a single request
+EVALSCRIPT_NDMI_SERIES = """
+    //VERSION=3
+    function setup() {
+        return {
+            input: [{ bands: ["B08", "B11", "dataMask"] }],
+            output: { bands: 2 },
+            mosaicking: "ORBIT"
+        };
+    }
+    function updateOutput(outputs, collection) {
+        outputs.default.bands = Math.max(collection.scenes.orbits.length, 1) * 2;
+    }
+    function updateOutputMetadata(scenes, inputMetadata, outputMetadata) {
+        outputMetadata.userData = { dates: scenes.orbits.map(orbit => orbit.dateFrom) };
+    }
+    function evaluatePixel(samples) {
+        let values = [];
+        for (let sample of samples) {
+            values.push((sample.B08 - sample.B11) / (sample.B08 + sample.B11), sample.dataMask);
+        }
+        return values.length ? values : [0, 0];
+    }
+"""
+
+EVALSCRIPT_BANDS_SERIES = """
+    //VERSION=3
+    function setup() {
+        return {
+            input: [{ bands: ["B02", "B03", "B04", "B08", "B11", "dataMask"] }],
+            output: { bands: 6, sampleType: "FLOAT32" },
+            mosaicking: "ORBIT"
+        };
+    }
+    function updateOutput(outputs, collection) {
+        outputs.default.bands = Math.max(collection.scenes.orbits.length, 1) * 6;
+    }
+    function updateOutputMetadata(scenes, inputMetadata, outputMetadata) {
+        outputMetadata.userData = { dates: scenes.orbits.map(orbit => orbit.dateFrom) };
+    }
+    function evaluatePixel(samples) {
+        let values = [];
+        for (let sample of samples) {
+            values.push(sample.B02, sample.B03, sample.B04, sample.B08, sample.B11, sample.dataMask);
+        }
+        return values.length ? values : [0, 0, 0, 0, 0, 0];
+    }
+"""
+
+SERIES_EVALSCRIPTS = {EVALSCRIPT_NDMI_MASKED: EVALSCRIPT_NDMI_SERIES, EVALSCRIPT_BANDS_MASKED: EVALSCRIPT_BANDS_SERIES}
+
+# With a spectral model at FLOOD_MODEL_PATH (see flood_model.py) the GIFs use it instead
+# of the NDMI threshold. It is loaded on first use (at start-up in the API processes), once
+# per process, so render workers, which re-import this module, never load it.
+def served_model():
+    return get_flood_model()
+
+def day_evalscript():
+    """Per-day rasters: NDMI for the threshold, raw bands for the flood model."""
+    return EVALSCRIPT_NDMI_MASKED if served_model() is None else EVALSCRIPT_BANDS_MASKED
+
+# Identical in-flight raster fetches and GIF builds share one computation
+raster_flight = SingleFlight()
+gif_flight = AsyncSingleFlight()
+gif_streams = AsyncStreamFlight()
+
 app = FastAPI()
 
+def get_render_pool():
+    global render_pool
+    if render_pool is None:
+        # Forking while fetch threads hold locks can leave a worker deadlocked, so workers are spawned fresh
+        render_pool = ProcessPoolExecutor(max_workers=RENDER_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return render_pool
+
+@app.middleware("http")
+async def add_server_timing(request: Request, call_next):
+    timings = metrics.begin_request()
+    response = await call_next(request)
+    if timings:
+        response.headers["Server-Timing"] = metrics.server_timing_header(timings)
+    return response
+
+@app.get("/metrics")
+def get_metrics():
+    return Response(metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.on_event("startup")
+def load_flood_model():
+    served_model()
+
+@app.on_event("shutdown")
+def shutdown_render_pool():
+    if render_pool is not None:
+        render_pool.shutdown(wait=False, cancel_futures=True)
+    flood_model = served_model()
+    if flood_model is not None:
+        flood_model.close()
+
 @lru_cache(maxsize=128)
 def calculate_bounding_box(lat, lon, radius_km):
-    north = great_circle(kilometers=radius_km).destination((lat, lon), 0)  # North
-    south = great_circle(kilometers=radius_km).destination((lat, lon), 180)  # South
-    east = great_circle(kilometers=radius_km).destination((lat, lon), 90)  # East
-    west = great_circle(kilometers=radius_km).destination((lat, lon), 270)  # West
-    return [west.longitude, south.latitude, east.longitude, north.latitude]
+    return point_bboxes(lat, lon, radius_km).tolist()
 
-@lru_cache(maxsize=128)
-def get_flood_image(lat, lon, radius_km, time_interval, resolution=60, tot=0.5):
+def canonical_point(lat, lon, radius_km, resolution=60):
+    """The query nearby requests share when snapping is on (see snapping.py), else the query as is."""
+    if SNAP_TILE_PIXELS:
+        return snap_point(lat, lon, radius_km, resolution)
+    return lat, lon, radius_km
+
+def get_ndmi_raster(lat, lon, radius_km, time_interval, resolution=60, evalscript=EVALSCRIPT_NDMI):
     bounding_box = calculate_bounding_box(lat, lon, radius_km)
+    if SNAP_TILE_PIXELS:
+        # Only the shared grid tiles are cached
+        return get_snapped_raster(bounding_box, time_interval, resolution, evalscript)
+    cache_key = raster_cache.make_key(bounding_box, time_interval, resolution, evalscript)
+    # Days whose imagery may still be arriving are fetched again once their entry is old
+    ndmi_data = raster_cache.get(cache_key, max_age=max_age_for(time_interval))
+    metrics.record_cache("raster", ndmi_data is not None)
+    if ndmi_data is not None:
+        return ndmi_data
+    return raster_flight.do(cache_key, fetch_ndmi_raster, bounding_box, time_interval, resolution, evalscript, cache_key)
+
+def get_snapped_raster(bounding_box, time_interval, resolution=60, evalscript=EVALSCRIPT_NDMI):
+    """The raster of `bounding_box` cut from the canonical grid tiles covering it, which nearby queries share."""
+    tiles = covering_tiles(bounding_box, resolution)
+    results = fetch_windows(
+        lambda tile: get_tile_raster(tile, time_interval, resolution, evalscript),
+        tiles, max_concurrency=FETCH_CONCURRENCY,
+    )
+    for result in results:
+        # A missing tile would leave a hole in the area, so the whole raster fails
+        if result.error is not None:
+            raise result.error
+    return crop_tiles(tiles, [result.value for result in results], bounding_box, resolution)
+
+def fetch_ndmi_raster(bounding_box, time_interval, resolution, evalscript, cache_key, size=None):
     bbox = BBox(bbox=bounding_box, crs=CRS.WGS84)
-    size = bbox_to_dimensions(bbox, resolution=resolution)
-
-    evalscript_ndmi = """
-        //VERSION=3
-        function setup() {
-            return {
-                input: [{ bands: ["B08", "B11"] }],
-                output: { bands: 1 }
-            };
-        }
-        function evaluatePixel(sample) {
-            let ndmi = (sample.B08 - sample.B11) / (sample.B08 + sample.B11);
-            return [ndmi];
-        }
-    """
+    size = size or bbox_to_dimensions(bbox, resolution=resolution)
 
     request_ndmi = SentinelHubRequest(
-        evalscript=evalscript_ndmi,
+        evalscript=evalscript,
         input_data=[SentinelHubRequest.input_data(
-            data_collection=DataCollection.SENTINEL2_L1C,
+            data_collection=DATA_COLLECTION,
             time_interval=time_interval,
         )],
         responses=[SentinelHubRequest.output_response("default", MimeType.TIFF)],
@@ -63,94 +263,566 @@ def get_flood_image(lat, lon, radius_km, time_interval, resolution=60, tot=0.5):
         config=config,
     )
 
-    response = request_ndmi.get_data()
+    # Only actual Process API downloads count against the request budget, not cache hits
+    if rate_limiter is not None:
+        rate_limiter.acquire()
+    with metrics.timed("sentinelhub_download"):
+        response = token_manager.get_data(request_ndmi, config)
     ndmi_data = response[0]
-    water_mask = ndmi_data > (tot * 255)
+    raster_cache.put(cache_key, ndmi_data)
+    return ndmi_data
 
-    water_image = np.zeros(ndmi_data.shape, dtype=np.float32)
-    water_image[water_mask] = 1
+def get_day_rasters(lat, lon, radius_km, days, resolution=60, evalscript=None):
+    """FetchResults of the single-day rasters for `days` ((day, day) intervals), in order.
 
+    The rasters and their cache entries are those of get_ndmi_raster(..., (day, day), ...),
+    but the days missing from the cache are fetched with one multi-temporal request.
+    `evalscript` defaults to `day_evalscript()`.
+    """
+    evalscript = evalscript or day_evalscript()
+    bounding_box = calculate_bounding_box(lat, lon, radius_km)
+    try:
+        if SNAP_TILE_PIXELS:
+            rasters = get_snapped_day_rasters(bounding_box, days, resolution, evalscript)
+        else:
+            rasters = get_area_day_rasters(bounding_box, days, resolution, evalscript)
+    except Exception as e:
+        return [FetchResult(day, None, e) for day in days]
+    return [FetchResult(day, rasters[day[0]], None) for day in days]
+
+def get_area_day_rasters(bounding_box, days, resolution, evalscript, size=None):
+    """{day: raster} over one bbox (requested at `size` when given, as tiles are)."""
+    extra = (size,) if size else ()
+    rasters = {}
+    missing = []
+    for day in days:
+        raster = raster_cache.get(raster_cache.make_key(bounding_box, day, resolution, evalscript, *extra), max_age=max_age_for(day))
+        metrics.record_cache("raster", raster is not None)
+        if raster is None:
+            missing.append(day)
+        else:
+            rasters[day[0]] = raster
+    if not missing:
+        return rasters
+
+    def fetch_and_cache():
+        series = fetch_day_series(bounding_box, (missing[0][0], missing[-1][1]), resolution, evalscript, size)
+        for day, raster in series.items():
+            raster_cache.put(raster_cache.make_key(bounding_box, (day, day), resolution, evalscript, *extra), raster)
+        return series
+
+    flight_key = raster_cache.make_key(bounding_box, (missing[0][0], missing[-1][1]), resolution, evalscript, "series", *extra)
+    series = raster_flight.do(flight_key, fetch_and_cache)
+    for day in missing:
+        rasters[day[0]] = series[day[0]]
+    return rasters
+
+def get_snapped_day_rasters(bounding_box, days, resolution, evalscript):
+    """`get_area_day_rasters` cut from the canonical grid tiles, as get_snapped_raster does."""
+    tiles = covering_tiles(bounding_box, resolution)
+    results = fetch_windows(
+        lambda tile: get_area_day_rasters(tile.bbox, days, resolution, evalscript, tile.size),
+        tiles, max_concurrency=FETCH_CONCURRENCY,
+    )
+    for result in results:
+        if result.error is not None:
+            raise result.error
+    return {
+        day: crop_tiles(tiles, [result.value[day] for result in results], bounding_box, resolution)
+        for day, _ in days
+    }
+
+def fetch_day_series(bounding_box, time_interval, resolution, evalscript, size=None):
+    """{day: (values..., dataMask) raster} for every day of `time_interval`, from one Process API request.
+
+    Days without an acquisition get an all-zero raster, as a single-day request returns.
+    """
+    bbox = BBox(bbox=bounding_box, crs=CRS.WGS84)
+    size = size or bbox_to_dimensions(bbox, resolution=resolution)
+
+    request_series = SentinelHubRequest(
+        evalscript=SERIES_EVALSCRIPTS[evalscript],
+        input_data=[SentinelHubRequest.input_data(
+            data_collection=DATA_COLLECTION,
+            time_interval=time_interval,
+        )],
+        responses=[
+            SentinelHubRequest.output_response("default", MimeType.TIFF),
+            SentinelHubRequest.output_response("userdata", MimeType.JSON),
+        ],
+        bbox=bbox,
+        size=size,
+        config=config,
+    )
+
+    if rate_limiter is not None:
+        rate_limiter.acquire()
+    with metrics.timed("sentinelhub_download"):
+        response = token_manager.get_data(request_series, config)[0]
+    stack, dates = response["default.tif"], response["userdata.json"]["dates"]
+    channels = stack.shape[-1] // max(len(dates), 1)
+
+    # Scenes come most recent first; several on one day are mosaicked like a single-day request
+    scenes = {}
+    for index, date in reversed(list(enumerate(dates))):
+        scenes.setdefault(date[:10], []).append(stack[..., index * channels:(index + 1) * channels])
+    empty = np.zeros(stack.shape[:2] + (channels,), dtype=stack.dtype)
+    return {
+        day: composite_scenes(scenes[day]) if day in scenes else empty
+        for day, _ in build_window_days([time_interval])
+    }
+
+def composite_scenes(rasters):
+    """Most recent valid pixel of same-day (values..., dataMask) rasters, keeping the dataMask channel."""
+    out = rasters[0].copy()
+    for raster in rasters[1:]:
+        valid = raster[..., -1] > 0
+        out[valid] = raster[valid]
+    return out
+
+def get_tile_raster(tile, time_interval, resolution=60, evalscript=EVALSCRIPT_NDMI):
+    # Tiles are requested at their exact pixel size so they line up in the mosaic
+    cache_key = raster_cache.make_key(tile.bbox, time_interval, resolution, evalscript, tile.size)
+    ndmi_data = raster_cache.get(cache_key, max_age=max_age_for(time_interval))
+    metrics.record_cache("raster", ndmi_data is not None)
+    if ndmi_data is not None:
+        return ndmi_data
+    return raster_flight.do(cache_key, fetch_ndmi_raster, tile.bbox, time_interval, resolution, evalscript, cache_key, tile.size)
+
+def get_large_area_flood_image(bounding_box, time_interval, resolution=60, tot=0.5):
+    """Water mask for an area of any size, fetched as a grid of tiles within the Process API size limit."""
+    tiles, shape = split_bbox(bounding_box, resolution)
+    pool = get_render_pool()
+
+    def fetch_and_threshold(tile):
+        ndmi_data = get_tile_raster(tile, time_interval, resolution)
+        # Thresholding runs in the worker processes while other tiles are still downloading
+        return pool.submit(threshold_tile, ndmi_data, tot * 255).result()
+
+    results = fetch_windows(fetch_and_threshold, tiles, max_concurrency=FETCH_CONCURRENCY)
+    for result in results:
+        if result.error is not None:
+            print(f"Skipping tile {result.window.row},{result.window.col}: {result.error}")
+    if all(result.error is not None for result in results):
+        raise results[0].error
+    return mosaic_masks(tiles, [result.value for result in results], shape)
+
+@lru_cache(maxsize=128)
+def get_flood_image(lat, lon, radius_km, time_interval, resolution=60, tot=0.5):
+    # Water masks are cached bit-packed, next to the NDMI rasters they come from
+    bounding_box = calculate_bounding_box(lat, lon, radius_km)
+    cache_key = raster_cache.make_key(bounding_box, time_interval, resolution, EVALSCRIPT_NDMI, "water", tot)
+    buffer = raster_cache.get(cache_key, max_age=max_age_for(time_interval))
+    metrics.record_cache("water", buffer is not None)
+    if buffer is not None:
+        return PackedMask.from_buffer(buffer)
+
+    ndmi_data = get_ndmi_raster(lat, lon, radius_km, time_interval, resolution)
+    water_image = threshold_water(ndmi_data, tot)
+    raster_cache.put(cache_key, water_image.to_buffer())
     return water_image
 
-def get_range_of_flooding_areas(lat, lon, radius_km, time_interval, skip=1, consider=1, resolution=60, tot=0.5):
+def threshold_water(ndmi_data, tot=0.5):
+    return PackedMask.from_bool(ndmi_data > (tot * 255))
+
+def detect_water(composite, tot=0.5):
+    """Water mask of a composited day raster: the flood model when one is loaded, else the NDMI threshold."""
+    flood_model = served_model()
+    if flood_model is None:
+        return threshold_water(composite, tot)
+    return flood_model.flood_mask(spectral_features(split_bands(composite), flood_model.feature_names))
+
+def build_time_windows(time_interval, skip=1, consider=1):
     start_date = datetime.strptime(time_interval[0], "%Y-%m-%d")
     end_date = datetime.strptime(time_interval[1], "%Y-%m-%d")
     delta = timedelta(days=skip)
     consider_days = timedelta(days=consider)
-    water_images = []
-    dates = []
+    windows = []
 
     while start_date <= end_date:
-        time_interval = (start_date.strftime("%Y-%m-%d"), (start_date + consider_days).strftime("%Y-%m-%d"))
-        water_image = get_flood_image(lat, lon, radius_km, time_interval, resolution, tot)
-        water_images.append(water_image)
-        dates.append(time_interval[0])
+        windows.append((start_date.strftime("%Y-%m-%d"), (start_date + consider_days).strftime("%Y-%m-%d")))
         start_date += delta
 
-    return water_images, dates
+    return windows
+
+def build_window_days(windows):
+    """Distinct single-day intervals covering all windows (window ends are inclusive), up to today.
+
+    Windows near today reach into the future, which has no imagery to fetch.
+    """
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    days = set()
+    for window_start, window_end in windows:
+        day = datetime.strptime(window_start, "%Y-%m-%d")
+        while day <= min(datetime.strptime(window_end, "%Y-%m-%d"), today):
+            days.add(day.strftime("%Y-%m-%d"))
+            day += timedelta(days=1)
+    return [(day, day) for day in sorted(days)]
+
+def composite_days(day_rasters):
+    """Mosaic single-day (value(s)..., dataMask) rasters, keeping the most recent valid pixel.
+
+    Mirrors the Process API's default mostRecent mosaicking for a multi-day window.
+    A single value comes back as a 2-D array; pixels with no data stay 0 (NaN for floats).
+    """
+    first = day_rasters[0]
+    values = first.shape[-1] - 1
+    fill = np.nan if first.dtype.kind == "f" else 0
+    composite = np.full(first.shape[:2] + ((values,) if values > 1 else ()), fill, dtype=first.dtype)
+    for raster in day_rasters:
+        valid = raster[..., -1] > 0
+        composite[valid] = (raster[..., 0] if values == 1 else raster[..., :-1])[valid]
+    return composite
+
+def window_rasters(window, day_rasters):
+    rasters = [day_rasters[day] for day, _ in build_window_days([window]) if day in day_rasters]
+    if not rasters:
+        print(f"Skipping window {window}: no imagery fetched")
+    return rasters
 
-def add_text_with_fade(images, texts, fade_steps=10, font_size=20, output_size=None):
-    faded_images = []
-    font = ImageFont.load_default(font_size)
+def ready_windows(pending, day_rasters, fetched_through=None):
+    """Pop the windows whose last day has been fetched (all of them when `fetched_through` is None).
 
-    for i, img in enumerate(images):
-        img = Image.fromarray((img * 255).astype(np.uint8))
-        if output_size:
-            img = img.resize(output_size)
+    Yields (date, day rasters) per window, then forgets days no remaining window needs.
+    """
+    while pending and (fetched_through is None or pending[0][1] <= fetched_through):
+        window = pending.popleft()
+        rasters = window_rasters(window, day_rasters)
+        if rasters:
+            yield window[0], rasters
+    for day in [day for day in day_rasters if not pending or day < pending[0][0]]:
+        del day_rasters[day]
 
-        draw = ImageDraw.Draw(img)
-        text = texts[i] if i < len(texts) else ""
-        draw.text((100, 100), text, font=font, fill="#0000FF")
+async def iter_window_rasters(windows, day_results):
+    """Streaming `assemble_windows`: yield each window's day rasters once its days are in.
 
-        if i > 0:
-            fade_image = faded_images[i - 1].copy()
-            fade_factor = 1 - (1 - 0.1) ** (i + 1)
-            fade_image = Image.blend(fade_image, img, fade_factor)
-            faded_images.append(fade_image)
+    `day_results` is an in-order async iterator of per-day fetch results. Days are
+    dropped as soon as no upcoming window needs them, so what is held is the days of
+    the windows still open plus whatever `day_results` itself buffers (see iter_day_results).
+    """
+    pending = deque(windows)
+    day_rasters = {}
+    errors = []
+    produced = 0
+    async for result in day_results:
+        day = result.window[0]
+        if result.error is None:
+            day_rasters[day] = result.value
         else:
-            faded_images.append(img)
+            errors.append(result.error)
+        for item in ready_windows(pending, day_rasters, day):
+            produced += 1
+            yield item
+    for item in ready_windows(pending, day_rasters):
+        produced += 1
+        yield item
+
+    if windows and not produced:
+        raise errors[0] if errors else ValueError("No days up to today in the requested windows")
 
-    return faded_images
+async def iter_window_waters(windows, cached, day_results, tot=0.5, store=None):
+    """Streaming `assemble_windows`: (date, water mask) per window, in order.
+
+    Windows in `cached` come straight from it; the others are built from `day_results`
+    (the days of those windows only) as they arrive and passed to `store(window, mask)`.
+    """
+    async with aclosing(iter_window_rasters([window for window in windows if window not in cached], day_results)) as built:
+        async def next_built():
+            try:
+                return await anext(built, None)
+            except Exception as e:
+                # Cached windows can still be shown when none of the others have imagery
+                if not cached:
+                    raise
+                print(f"Skipping uncached windows: {e}")
+                return None
 
-def generate_gif(images, filename):
-    images[0].save(filename, save_all=True, append_images=images[1:], duration=1000, loop=0)
+        pending = None
+        for window in windows:
+            if window in cached:
+                yield window[0], cached[window]
+                continue
+            if pending is None:
+                pending = await next_built()
+            # Windows without imagery are not produced, so a built one may belong to a later window
+            if pending is None or pending[0] != window[0]:
+                continue
+            date, rasters = pending
+            pending = None
+            water = await asyncio.to_thread(detect_water, composite_days(rasters), tot)
+            if store is not None:
+                store(window, water)
+            yield date, water
+
+def assemble_windows(windows, day_results, tot=0.5, cached=None, store=None):
+    """Build per-window water images locally from per-day fetch results.
+
+    Windows in `cached` ({window: mask}) are used as they are; each mask built for
+    another window is passed to `store(window, mask)`.
+    """
+    cached = cached or {}
+    day_rasters = {result.window[0]: result.value for result in day_results if result.error is None}
+    water_images = []
+    dates = []
+    for window in windows:
+        water = cached.get(window)
+        if water is None:
+            rasters = window_rasters(window, day_rasters)
+            if not rasters:
+                continue
+            water = detect_water(composite_days(rasters), tot)
+            if store is not None:
+                store(window, water)
+        water_images.append(water)
+        dates.append(window[0])
+
+    if windows and not water_images:
+        raise next(
+            (result.error for result in day_results if result.error is not None),
+            ValueError("No days up to today in the requested windows"),
+        )
+    return water_images, dates
+
+def collect_water_images(results):
+    """Split fetch results into images and dates, dropping windows that failed."""
+    water_images = []
+    dates = []
+    for result in results:
+        if result.error is not None:
+            print(f"Skipping window {result.window}: {result.error}")
+            continue
+        water_images.append(result.value)
+        dates.append(result.window[0])
+
+    # Only give up when there is nothing left to render
+    if results and not water_images:
+        raise results[0].error
+    return water_images, dates
+
+def get_range_of_flooding_areas(lat, lon, radius_km, time_interval, skip=1, consider=1, resolution=60, tot=0.5, max_concurrency=FETCH_CONCURRENCY, per_day=False):
+    windows = build_time_windows(time_interval, skip, consider)
+    if per_day:
+        # Fetch every distinct day in one request and rebuild the overlapping windows locally
+        day_results = get_day_rasters(lat, lon, radius_km, build_window_days(windows), resolution)
+        return assemble_windows(windows, day_results, tot)
+
+    results = fetch_windows(
+        lambda window: get_flood_image(lat, lon, radius_km, window, resolution, tot),
+        windows, max_concurrency=max_concurrency,
+    )
+    return collect_water_images(results)
+
+def default_time_interval():
+    """The last 7 days, used when a request gives no dates."""
+    return (datetime.now() - timedelta(days=7)).strftime("%Y-%m-%d"), datetime.now().strftime("%Y-%m-%d")
 
 def get_gif_cache_filename(lat, lon, radius_km, time_interval):
-    hash_input = f"{lat}_{lon}_{radius_km}_{time_interval}"
-    hash_key = hashlib.md5(hash_input.encode()).hexdigest()
-    return f"cache/flooding_{hash_key}.gif"
+    flood_model = served_model()
+    if flood_model is not None:
+        return gif_cache.path(lat, lon, radius_km, time_interval, flood_model.tag)
+    return gif_cache.path(lat, lon, radius_km, time_interval)
 
-@app.get("/flood_gif/")
-async def create_flood_gif(lat: float, lon: float, radius_km: int=10, start_date:str|None=None, end_date:str|None=None):
+def window_water_key(lat, lon, radius_km, window, tot=0.5):
+    bounding_box = calculate_bounding_box(lat, lon, radius_km)
+    flood_model = served_model()
+    method = flood_model.tag if flood_model is not None else tot
+    return raster_cache.make_key(bounding_box, window, 60, day_evalscript(), "window_water", method)
+
+def get_cached_window_waters(lat, lon, radius_km, windows, tot=0.5):
+    """{window: water mask} for the GIF windows already in the raster cache.
+
+    Consecutive default GIFs share all but one day, so most of their frames come from here.
+    """
+    cached = {}
+    for window in windows:
+        buffer = raster_cache.get(window_water_key(lat, lon, radius_km, window, tot), max_age=max_age_for(window))
+        metrics.record_cache("frame", buffer is not None)
+        if buffer is not None:
+            cached[window] = PackedMask.from_buffer(buffer)
+    return cached
+
+def window_water_store(lat, lon, radius_km, tot=0.5):
+    return lambda window, water: raster_cache.put(window_water_key(lat, lon, radius_km, window, tot), water.to_buffer())
+
+def missing_window_days(windows, cached):
+    return build_window_days([window for window in windows if window not in cached])
+
+async def build_flood_gif(lat, lon, radius_km, start_date, end_date, gif_path):
+    # Another request may have finished the file while this one was queued
+    if gif_cache.get(gif_path, (start_date, end_date)):
+        return gif_path
+
+    # Fetch the days not covered by cached frames in one request, without blocking the event loop
+    windows = build_time_windows((start_date, end_date), skip=1, consider=2)
+    cached = await asyncio.to_thread(get_cached_window_waters, lat, lon, radius_km, windows)
+    with metrics.timed("fetch"):
+        day_results = await asyncio.to_thread(get_day_rasters, lat, lon, radius_km, missing_window_days(windows, cached))
+    with metrics.timed("threshold"):
+        water_images, dates = await asyncio.to_thread(
+            assemble_windows, windows, day_results, 0.5, cached, window_water_store(lat, lon, radius_km),
+        )
+
+    # Fade and encode the GIF in a worker process
+    loop = asyncio.get_running_loop()
+    render_timings = await loop.run_in_executor(get_render_pool(), render_flood_gif, water_images, dates, gif_path, 5, 20)
+    for stage, seconds in render_timings.items():
+        metrics.observe_stage(stage, seconds)
+    gif_cache.add(gif_path)
+    return gif_path
+
+async def iter_day_results(lat, lon, radius_km, days, chunk_days=STREAM_CHUNK_DAYS):
+    """`get_day_rasters` as the in-order async iterator of results iter_window_waters consumes.
+
+    Days are fetched in chunks of `chunk_days` (one multi-temporal request each), at most
+    STREAM_CHUNKS_AHEAD chunks ahead of the consumer, so the first frames go out while
+    later days are still downloading and at most those chunks are held at once.
+    """
+    chunks = [days[i:i + chunk_days] for i in range(0, len(days), chunk_days)]
+    fetch = lambda chunk: get_day_rasters(lat, lon, radius_km, chunk)
+    async with aclosing(iter_fetch_windows_async(fetch, chunks, max_concurrency=STREAM_CHUNKS_AHEAD)) as results:
+        async for chunk_result in results:
+            if chunk_result.error is not None:
+                for day in chunk_result.window:
+                    yield FetchResult(day, None, chunk_result.error)
+                continue
+            for result in chunk_result.value:
+                yield result
+
+def render_window_frame(water, date, fader, encoder):
+    return encoder.add_frame(fader.add(water, date))
+
+async def stream_flood_gif(lat, lon, radius_km, start_date, end_date, gif_path):
+    """Fetch the days, then threshold, fade and encode one window at a time, yielding GIF bytes as they are ready.
+
+    The same bytes go to a temporary file that replaces `gif_path` once the GIF is complete,
+    so a streamed response also fills the cache.
+    """
+    windows = build_time_windows((start_date, end_date), skip=1, consider=2)
+    cached = await asyncio.to_thread(get_cached_window_waters, lat, lon, radius_km, windows)
+    day_results = iter_day_results(lat, lon, radius_km, missing_window_days(windows, cached))
+    waters = iter_window_waters(windows, cached, day_results, store=window_water_store(lat, lon, radius_km))
+    fader = FrameFader(font_size=20)
+    encoder = GifStreamEncoder()
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(gif_path) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            async with aclosing(day_results), aclosing(waters) as frames:
+                async for date, water in frames:
+                    # Fading and encoding a frame is CPU work, keep it off the event loop
+                    chunk = await asyncio.to_thread(render_window_frame, water, date, fader, encoder)
+                    f.write(chunk)
+                    yield chunk
+            # A trailer alone is not a GIF, and must not end up in the cache
+            if encoder.previous is None:
+                raise ValueError("No frames to render")
+            chunk = encoder.finish()
+            f.write(chunk)
+            yield chunk
+        os.replace(tmp_path, gif_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    gif_cache.add(gif_path)
+
+@app.get("/flood_map/")
+async def create_flood_map(west: float, south: float, east: float, north: float, start_date:str|None=None, end_date:str|None=None, resolution: int=60):
     if not start_date or not end_date:
-        start_date = (datetime.now() - timedelta(days=7)).strftime("%Y-%m-%d")
-        end_date = datetime.now().strftime("%Y-%m-%d")
+        start_date, end_date = default_time_interval()
     try:
-        # Create cache directory if it doesn't exist
-        os.makedirs("cache", exist_ok=True)
+        water = await asyncio.to_thread(get_large_area_flood_image, (west, south, east, north), (start_date, end_date), resolution)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    # PIL's 1-bit mode uses the same row-padded packed layout, so the mask is never unpacked
+    png = io.BytesIO()
+    Image.frombytes("1", water.shape[::-1], water.bits.tobytes()).save(png, format="PNG")
+    return Response(png.getvalue(), media_type="image/png", headers={"X-Flooded-Fraction": f"{water.fraction():.4f}"})
 
+@app.get("/flood_probability/")
+async def create_flood_probability(lat: float, lon: float, radius_km: int=10, start_date:str|None=None, end_date:str|None=None, resolution: int=60):
+    """Flood probability from the learned model as a grayscale PNG (255 = certain flood, 0 = dry or no data)."""
+    flood_model = served_model()
+    if flood_model is None:
+        raise HTTPException(status_code=404, detail="No flood model is being served")
+    if not start_date or not end_date:
+        start_date, end_date = default_time_interval()
+    lat, lon, radius_km = canonical_point(lat, lon, radius_km, resolution)
+    try:
+        raster = await asyncio.to_thread(get_ndmi_raster, lat, lon, radius_km, (start_date, end_date), resolution, EVALSCRIPT_BANDS_MASKED)
+        bands = split_bands(raster[..., :-1], data_mask=raster[..., -1])
+        with metrics.timed("inference"):
+            probability = await asyncio.to_thread(flood_model.predict_proba, spectral_features(bands, flood_model.feature_names))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    png = io.BytesIO()
+    Image.fromarray(np.round(np.nan_to_num(probability) * 255).astype(np.uint8)).save(png, format="PNG")
+    return Response(png.getvalue(), media_type="image/png")
+
+def check_gif_range(start_date, end_date):
+    """400 for dates the GIF would have no frames for: unparsable, reversed or starting after today."""
+    try:
+        start = datetime.strptime(start_date, "%Y-%m-%d")
+        end = datetime.strptime(end_date, "%Y-%m-%d")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if start > end:
+        raise HTTPException(status_code=400, detail="start_date is after end_date")
+    if start > datetime.now():
+        raise HTTPException(status_code=400, detail="start_date is in the future")
+
+@app.get("/flood_gif/")
+async def create_flood_gif(lat: float, lon: float, radius_km: int=10, start_date:str|None=None, end_date:str|None=None, stream: bool=False):
+    if not start_date or not end_date:
+        start_date, end_date = default_time_interval()
+    check_gif_range(start_date, end_date)
+    lat, lon, radius_km = canonical_point(lat, lon, radius_km)
+    try:
         gif_path = get_gif_cache_filename(lat, lon, radius_km, (start_date, end_date))
 
-        # Check if the GIF is already cached
-        if os.path.exists(gif_path):
+        # Check if a GIF that is still fresh for these dates is cached
+        gif_cached = gif_cache.get(gif_path, (start_date, end_date))
+        metrics.record_cache("gif", gif_cached)
+        if gif_cached:
             return FileResponse(gif_path, media_type='image/gif')
 
-        time_interval = (start_date, end_date)
-        water_images, dates = get_range_of_flooding_areas(
-            lat, lon, radius_km, time_interval,
-            skip=1, consider=2, resolution=60, tot=0.5
-        )
+        if stream and not gif_flight.in_flight(gif_path):
+            # Send frames as they are produced; wait for the first one so failures still return a 500.
+            # Identical concurrent streams share one producer, later ones replaying what it has sent.
+            chunks = gif_streams.stream(gif_path, stream_flood_gif, lat, lon, radius_km, start_date, end_date, gif_path)
+            first_chunk = await anext(chunks)
+
+            async def body():
+                yield first_chunk
+                async for chunk in chunks:
+                    yield chunk
 
-        result_images = add_text_with_fade(water_images, dates, fade_steps=5, font_size=20)
+            return StreamingResponse(body(), media_type='image/gif')
 
-        # Generate and save GIF
-        generate_gif(result_images, gif_path)
+        # Concurrent requests for the same GIF wait on a single build, or on the stream producing it
+        await gif_streams.wait(gif_path)
+        await gif_flight.do(gif_path, build_flood_gif, lat, lon, radius_km, start_date, end_date, gif_path)
 
         return FileResponse(gif_path, media_type='image/gif')
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def collect_lru_metrics():
+    info = get_flood_image.cache_info()
+    return [
+        "# HELP terrasense_flood_image_lru_total In-process get_flood_image cache lookups by result.",
+        "# TYPE terrasense_flood_image_lru_total counter",
+        f'terrasense_flood_image_lru_total{{result="hit"}} {info.hits}',
+        f'terrasense_flood_image_lru_total{{result="miss"}} {info.misses}',
+        "# HELP terrasense_flood_image_lru_size Entries held by the get_flood_image cache.",
+        "# TYPE terrasense_flood_image_lru_size gauge",
+        f"terrasense_flood_image_lru_size {info.currsize}",
+    ]
+
+metrics.REGISTRY.register_collector(collect_lru_metrics)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
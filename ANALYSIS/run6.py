@@ -1,4 +1,5 @@
 from sentinelhub import SHConfig
+from sh_session import get_config_token_manager
 from dotenv import load_dotenv
 from pathlib import Path
 import os
@@ -11,6 +12,9 @@ config = SHConfig()
 if not config.sh_client_id or not config.sh_client_secret:
     print("Warning! To use Process API, please provide the credentials (OAuth client ID and client secret).")
 
+# One cached OAuth token and pooled HTTP session for every request in the process
+token_manager = get_config_token_manager(config)
+
 import datetime
 import os
 
@@ -31,6 +35,27 @@ from sentinelhub import (
 
 # The following is not a package. It is a file utils.py which should be in the same folder as this notebook.
 from utils import plot_image
+from products import fetch_bands, fetch_flood_mask
+from raster_cache import RasterCache
+from gif_cache import max_age_for
+from masks import PackedMask
+from alerts import default_alert_interval, point_bbox, score_flood, score_points
+from risk_grid import RiskGrid, grid_method
+from flood_model import fetch_model_mask, get_flood_model, spectral_features
+
+# Shares the on-disk raster cache with the /flood_gif/ service (run10.py)
+raster_cache = RasterCache(
+    os.getenv("RASTER_CACHE_DIR", "cache/rasters"),
+    max_bytes=int(os.getenv("RASTER_CACHE_MAX_BYTES") or 2 * 1024 ** 3),
+)
+
+FETCH_CONCURRENCY = int(os.getenv("FETCH_CONCURRENCY", "4"))
+
+# Overridable so benchmarks can point requests at a fake Sentinel Hub
+DATA_COLLECTION = DataCollection.SENTINEL2_L1C
+
+# Learned flood model (flood_model.py), loaded once; None keeps the NDWI/NDVI rule
+flood_model = get_flood_model()
 
 # betsiboka_coords_wgs84 = (46.16, -16.15, 46.51, -15.58)
 AP_coords_wgs84 = (76.75, 12.61, 84.81, 19.92)
@@ -218,13 +243,20 @@ betsiboka_size = bbox_to_dimensions(betsiboka_bbox, resolution=resolution)
 # plot_image(flood, factor=3.5, clip_range=(0, 1), image_type='flood_detection')
 
 
-from flask import Flask, request, jsonify
+import json
+
+from flask import Flask, Response, request, jsonify, stream_with_context
 
 app = Flask(__name__)
 
+# Flood fraction per grid cell, refreshed in the background by risk_grid.py
+risk_grid = RiskGrid()
+
 def get_new_flood_hazard_info(lat, lon, radius_km=25, time_interval=TIME_INTERVAL, resolution=60, show=False, tot=0.5):
     """Get new flood hazard information"""
-    bbox = BBox(bbox=(lat, lon, lat, lon), crs=CRS.WGS84)
+    # The same area the risk grid and /alert/batch score: everything within radius_km of the point
+    bounding_box = tuple(point_bbox(lat, lon, radius_km))
+    bbox = BBox(bbox=bounding_box, crs=CRS.WGS84)
     size = bbox_to_dimensions(bbox, resolution=resolution)
 
     evalscript_flood = """
@@ -246,7 +278,7 @@ def get_new_flood_hazard_info(lat, lon, radius_km=25, time_interval=TIME_INTERVA
     request_flood = SentinelHubRequest(
         evalscript=evalscript_flood,
         input_data=[SentinelHubRequest.input_data(
-            data_collection=DataCollection.SENTINEL2_L1C,
+            data_collection=DATA_COLLECTION,
             time_interval=time_interval,
         )],
         responses=[SentinelHubRequest.output_response("default", MimeType.PNG)],
@@ -255,11 +287,26 @@ def get_new_flood_hazard_info(lat, lon, radius_km=25, time_interval=TIME_INTERVA
         config=config,
     )
 
-    flood_imgs = request_flood.get_data()
+    # The three bands carry the same 0/255 flag, so only one bit per pixel is kept
+    if flood_model is None:
+        cache_key = raster_cache.make_key(bounding_box, time_interval, resolution, evalscript_flood, "packed")
+    else:
+        cache_key = raster_cache.make_key(bounding_box, time_interval, resolution, flood_model.tag, "packed")
+    # A window reaching into the last day is fetched again once its entry is old
+    buffer = raster_cache.get(cache_key, max_age=max_age_for(time_interval))
+    if buffer is None:
+        if flood_model is None:
+            flood_imgs = token_manager.get_data(request_flood, config)
+            flood = PackedMask.from_bool(flood_imgs[0][..., 0] > 0)
+        else:
+            bands = fetch_bands(bbox, size, time_interval, config, DATA_COLLECTION)
+            flood = flood_model.flood_mask(spectral_features(bands, flood_model.feature_names))
+        raster_cache.put(cache_key, flood.to_buffer())
+    else:
+        flood = PackedMask.from_buffer(buffer)
 
-    flood = flood_imgs[0]
     if show:
-        plot_image(flood, factor=3.5, clip_range=(0, 1), image_type='flood_detection')
+        plot_image(flood.to_bool(), factor=3.5, clip_range=(0, 1), image_type='flood_detection')
 
     return flood
 
@@ -270,41 +317,75 @@ def alert():
     lat = data['lat']
     lon = data['lon']
     radius_km = data.get('radius_km', 25)
-    time_interval = data.get('time_interval')
-    if time_interval is None:
-        # -10 days from today to today
-        today = datetime.date.today()
-        time_interval = (str(today - datetime.timedelta(days=10)), str(today))
+    # the last 10 days up to today, the window the risk grid is refreshed for
+    time_interval = data.get('time_interval') or default_alert_interval()
 
     resolution = data.get('resolution', 60)
     show = data.get('show', False)
     tot = data.get('tot', 0.5)
 
-    flood = get_new_flood_hazard_info(lat, lon, radius_km, time_interval, resolution, show, tot)
+    # Areas inside the watched regions are answered from the precomputed grid when it holds this window
+    cells = None
+    if not data.get('live', False):
+        cells = risk_grid.lookup(point_bbox(lat, lon, radius_km), tuple(time_interval), grid_method(flood_model))
 
-    # if 10% of the image is flooded then return high danger level
-    if np.sum(flood) > 0.4 * flood.size:
-        danger_level = 'high'
-    if np.sum(flood) > 0.1 * flood.size:
-        danger_level = 'moderate'
+    if cells is None:
+        flood = get_new_flood_hazard_info(lat, lon, radius_km, time_interval, resolution, show, tot)
+        # high above 40% flooded, moderate above 10%
+        danger_level, _ = score_flood(flood)
+        image = flood.to_bool().astype(np.uint8) * 255
     else:
-        danger_level = 'low'
+        danger_level = cells['danger_level']
+        # One pixel per grid cell, from 0 (dry) to 255 (fully flooded)
+        image = np.round(cells['cell_fractions'] * 255).astype(np.uint8)
     # return danger level and base64 image
     from PIL import Image
     import io
     import base64
 
-    img = Image.fromarray((flood * 255).astype(np.uint8))
+    img = Image.fromarray(image)
     rawBytes = io.BytesIO()
     img.save(rawBytes, "PNG")
     rawBytes.seek(0)
-    img_base64 = base64.b64encode(rawBytes.read())
+    img_base64 = base64.b64encode(rawBytes.read()).decode("ascii")
 
     return jsonify({
         'danger_level': danger_level,
         'image': img_base64
     })
 
+@app.route('/alert/batch', methods=['POST'])
+def alert_batch():
+    """Score many {lat, lon, radius_km} points; results stream back as NDJSON, one line per point"""
+    data = request.get_json()
+    points = data['points']
+    time_interval = tuple(data.get('time_interval') or default_alert_interval())
+    resolution = data.get('resolution', 60)
+    use_grid = not data.get('live', False)
+    method = grid_method(flood_model)
+
+    def generate():
+        live = []
+        for index, point in enumerate(points):
+            cells = None
+            if use_grid:
+                cells = risk_grid.lookup(point_bbox(point['lat'], point['lon'], point.get('radius_km', 25)), time_interval, method)
+            if cells is None:
+                live.append(index)
+            else:
+                yield json.dumps({'index': index, 'danger_level': cells['danger_level'], 'flooded_fraction': cells['flooded_fraction']}) + '\n'
+
+        # Nearby points share one flood mask fetch; each line carries the point's input index
+        if flood_model is None:
+            fetch = lambda bbox: fetch_flood_mask(bbox, time_interval, resolution, config, DATA_COLLECTION)
+        else:
+            fetch = lambda bbox: fetch_model_mask(flood_model, bbox, time_interval, resolution, config, DATA_COLLECTION)
+        for result in score_points([points[i] for i in live], fetch, max_concurrency=FETCH_CONCURRENCY):
+            result['index'] = live[result['index']]
+            yield json.dumps(result) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
 if __name__ == '__main__':
     app.run(debug=True)
     # testing
\ No newline at end of file
@@ -0,0 +1,132 @@
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from sentinelhub import SentinelHubDownloadClient, SentinelHubSession
+
+TOKEN_URL = "https://services.sentinel-hub.com/oauth/token"
+
+
+class TokenManager:
+    """Caches a Sentinel Hub OAuth token and refreshes it before it expires.
+
+    One instance is shared by every caller in the process. All traffic goes over a
+    pooled keep-alive `requests.Session`, and the token is renewed by a background
+    timer `refresh_margin` seconds before expiry so requests never wait on it.
+    """
+
+    def __init__(self, client_id, client_secret, token_url=TOKEN_URL, refresh_margin=60, pool_size=16):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.token_url = token_url
+        self.refresh_margin = refresh_margin
+        self.http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.http.mount("https://", adapter)
+        self.http.mount("http://", adapter)
+        self._token = None
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def _fetch_token(self):
+        response = self.http.post(
+            self.token_url,
+            data={"grant_type": "client_credentials"},
+            auth=(self.client_id, self.client_secret),
+        )
+        if response.status_code != 200:
+            raise Exception(f"Failed to retrieve access token: {response.text}")
+        token = response.json()
+        token["expires_at"] = time.time() + token.get("expires_in", 3600)
+        return token
+
+    def _schedule_refresh(self, token):
+        if self._timer is not None:
+            self._timer.cancel()
+        delay = max(0, token["expires_at"] - time.time() - self.refresh_margin)
+        self._timer = threading.Timer(delay, self._background_refresh)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _background_refresh(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            # The next caller will retry synchronously once the old token expires
+            print(f"Background token refresh failed: {e}")
+
+    def refresh(self):
+        with self._lock:
+            self._token = self._fetch_token()
+            self._schedule_refresh(self._token)
+            return self._token
+
+    def get_token(self):
+        """Return the cached token dict, fetching a new one only if it has (nearly) expired."""
+        with self._lock:
+            if self._token is None or self._token["expires_at"] - time.time() < self.refresh_margin / 2:
+                self._token = self._fetch_token()
+                self._schedule_refresh(self._token)
+            return self._token
+
+    @property
+    def access_token(self):
+        return self.get_token()["access_token"]
+
+    def post(self, url, **kwargs):
+        """POST over the pooled session with the bearer token attached."""
+        headers = kwargs.pop("headers", {})
+        headers["Authorization"] = f"Bearer {self.access_token}"
+        return self.http.post(url, headers=headers, **kwargs)
+
+    def download_client(self, config):
+        """`SentinelHubDownloadClient` authenticated with the shared token, downloading over the pooled session."""
+        session = SentinelHubSession.from_token(self.get_token())
+        return PooledDownloadClient(self.http, config=config, session=session)
+
+    def get_data(self, request, config):
+        """Drop-in for `SentinelHubRequest.get_data()` that reuses the shared token."""
+        return self.download_client(config).download(request.download_list)
+
+
+class PooledDownloadClient(SentinelHubDownloadClient):
+    """`SentinelHubDownloadClient` sending its requests over a given `requests.Session`.
+
+    The stock client calls module-level `requests.request`, which opens a new
+    connection (and TLS handshake) for every download.
+    """
+
+    def __init__(self, http, **kwargs):
+        super().__init__(**kwargs)
+        self.http = http
+
+    def _do_download(self, request):
+        if request.url is None:
+            raise ValueError(f"Faulty request {request}, no URL specified.")
+
+        return self.http.request(
+            request.request_type.value,
+            url=request.url,
+            json=request.post_values,
+            headers=self._prepare_headers(request),
+            timeout=self.config.download_timeout_seconds,
+        )
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_token_manager(client_id, client_secret, token_url=TOKEN_URL):
+    """Process-wide TokenManager for the given credentials."""
+    key = (client_id, token_url)
+    with _managers_lock:
+        if key not in _managers:
+            _managers[key] = TokenManager(client_id, client_secret, token_url)
+        return _managers[key]
+
+
+def get_config_token_manager(config):
+    """Process-wide TokenManager for the credentials of an `SHConfig`."""
+    return get_token_manager(config.sh_client_id, config.sh_client_secret, config.sh_token_url)
@@ -0,0 +1,123 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    """Coalesce concurrent calls that share a key into a single execution.
+
+    The first caller for a key runs `fn`; callers arriving while it is still in
+    flight block and receive the same result (or exception). Nothing is cached
+    once the call finishes - that is left to the caches around it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Future()
+        if not leader:
+            return call.result()
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        else:
+            call.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+class AsyncSingleFlight:
+    """Asyncio version of `SingleFlight` for coroutine functions.
+
+    The shared task is shielded, so a client that disconnects does not cancel the
+    work the other waiters depend on.
+    """
+
+    def __init__(self):
+        self._tasks = {}
+
+    async def do(self, key, coro_fn, *args, **kwargs):
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(coro_fn(*args, **kwargs))
+            self._tasks[key] = task
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        return await asyncio.shield(task)
+
+    def in_flight(self, key):
+        return key in self._tasks
+
+
+class _SharedStream:
+    """Chunks of one async generator, kept so any number of followers can replay and follow them."""
+
+    def __init__(self, chunks):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self._changed = asyncio.Event()
+        self.task = asyncio.ensure_future(self._run(chunks))
+
+    async def _run(self, chunks):
+        try:
+            async for chunk in chunks:
+                self.chunks.append(chunk)
+                self._notify()
+        except BaseException as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._notify()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def follow(self):
+        sent = 0
+        while True:
+            if sent < len(self.chunks):
+                sent += 1
+                yield self.chunks[sent - 1]
+            elif self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            else:
+                await self._changed.wait()
+
+
+class AsyncStreamFlight:
+    """`AsyncSingleFlight` for async generators: callers sharing a key share one producer.
+
+    The first caller's generator runs as a background task; every caller gets an
+    iterator over all chunks produced so far and then the new ones as they come.
+    Like `AsyncSingleFlight`, a follower that disconnects does not stop the producer.
+    """
+
+    def __init__(self):
+        self._streams = {}
+
+    def stream(self, key, gen_fn, *args, **kwargs):
+        shared = self._streams.get(key)
+        if shared is None:
+            shared = self._streams[key] = _SharedStream(gen_fn(*args, **kwargs))
+            shared.task.add_done_callback(lambda _: self._streams.pop(key, None))
+        return shared.follow()
+
+    async def wait(self, key):
+        """Wait for the stream in flight for `key`, if any, to finish (successfully or not)."""
+        shared = self._streams.get(key)
+        if shared is not None:
+            await asyncio.shield(shared.task)
@@ -0,0 +1,93 @@
+import math
+import os
+
+import numpy as np
+from sentinelhub import CRS, BBox, bbox_to_dimensions
+
+from tiling import Tile
+
+# Canonical grid for point queries. Exact float coordinates make every cache key unique,
+# so two users 10 m apart never share a fetch. With snapping on, the query point and
+# radius are rounded to whole pixels of a fixed global grid at the requested resolution,
+# and rasters are fetched as the grid's SNAP_TILE_PIXELS-square tiles covering the area
+# of interest, then cropped and resampled to exactly what a direct request would return.
+# Nearby queries then hit the same cached tiles (and, once snapped, the same GIFs).
+#
+# The grid's pixels are `resolution` metres tall everywhere; their width in degrees is
+# fixed per row of tiles, from the cosine of the row's central latitude, so a tile is
+# the same whichever query asks for it.
+
+SNAP_TILE_PIXELS = int(os.getenv("SNAP_TILE_PIXELS", "0"))  # 0 disables snapping
+
+METERS_PER_DEGREE = 111320.0
+
+
+def tile_degrees(tile_row, resolution, tile_pixels=SNAP_TILE_PIXELS):
+    """(height, width) in degrees of the grid tiles in row `tile_row` (counted north from the equator)."""
+    tile_lat = tile_pixels * resolution / METERS_PER_DEGREE
+    row_center = (tile_row + 0.5) * tile_lat
+    return tile_lat, tile_pixels * resolution / (METERS_PER_DEGREE * max(math.cos(math.radians(row_center)), 1e-6))
+
+
+def tile_row_of(lat, resolution, tile_pixels=SNAP_TILE_PIXELS):
+    return math.floor(lat / (tile_pixels * resolution / METERS_PER_DEGREE))
+
+
+def snap_point(lat, lon, radius_km, resolution, tile_pixels=SNAP_TILE_PIXELS):
+    """(lat, lon, radius_km) moved by at most half a pixel onto the grid."""
+    tile_lat, tile_lon = tile_degrees(tile_row_of(lat, resolution, tile_pixels), resolution, tile_pixels)
+    lat_step, lon_step = tile_lat / tile_pixels, tile_lon / tile_pixels
+    pixel_km = resolution / 1000
+    return (
+        round(round(lat / lat_step) * lat_step, 9),
+        round(round(lon / lon_step) * lon_step, 9),
+        round(max(round(radius_km / pixel_km), 1) * pixel_km, 6),
+    )
+
+
+def covering_tiles(bounding_box, resolution, tile_pixels=SNAP_TILE_PIXELS):
+    """Grid tiles covering `bounding_box` (west, south, east, north), north to south and west to east.
+
+    A tile's `row` and `col` are its global grid indices and its bounds depend on
+    nothing else, so every query covering a tile requests, and caches, the same one.
+    """
+    west, south, east, north = bounding_box
+    tiles = []
+    for row in range(tile_row_of(north, resolution, tile_pixels), tile_row_of(south, resolution, tile_pixels) - 1, -1):
+        tile_lat, tile_lon = tile_degrees(row, resolution, tile_pixels)
+        first = math.floor(west / tile_lon)
+        for col in range(first, math.floor(east / tile_lon) + 1):
+            tile_bbox = (col * tile_lon, row * tile_lat, (col + 1) * tile_lon, (row + 1) * tile_lat)
+            x0 = (col - first) * tile_pixels
+            tiles.append(Tile(row, col, tile_bbox, (0, tile_pixels, x0, x0 + tile_pixels), (tile_pixels, tile_pixels)))
+    return tiles
+
+
+def crop_tiles(tiles, arrays, bounding_box, resolution, tile_pixels=SNAP_TILE_PIXELS):
+    """The pixels of `bounding_box` from its `covering_tiles`, at the size bbox_to_dimensions gives it.
+
+    Each output pixel takes the tile pixel under its centre (nearest neighbour, as
+    Sentinel Hub resamples by default). Rows of tiles have their own pixel widths, so
+    each is sampled on its own.
+    """
+    west, south, east, north = bounding_box
+    width, height = bbox_to_dimensions(BBox(bbox=bounding_box, crs=CRS.WGS84), resolution=resolution)
+    lons = west + (np.arange(width) + 0.5) * (east - west) / width
+    lats = north - (np.arange(height) + 0.5) * (north - south) / height
+    out = np.empty((height, width) + arrays[0].shape[2:], dtype=arrays[0].dtype)
+
+    strips = {}
+    for tile, array in zip(tiles, arrays):
+        strips.setdefault(tile.row, []).append((tile, array))
+    tile_rows = np.clip([tile_row_of(lat, resolution, tile_pixels) for lat in lats], min(strips), max(strips))
+    for row, strip_tiles in strips.items():
+        in_strip = tile_rows == row
+        if not in_strip.any():
+            continue
+        strip = np.concatenate([array for _, array in strip_tiles], axis=1)
+        strip_west, _, _, strip_north = strip_tiles[0][0].bbox
+        tile_lat, tile_lon = tile_degrees(row, resolution, tile_pixels)
+        rows = np.clip(np.floor((strip_north - lats[in_strip]) / tile_lat * tile_pixels).astype(np.intp), 0, tile_pixels - 1)
+        cols = np.clip(np.floor((lons - strip_west) / tile_lon * tile_pixels).astype(np.intp), 0, strip.shape[1] - 1)
+        out[in_strip] = strip[rows[:, None], cols[None, :]]
+    return out
@@ -0,0 +1,82 @@
+import math
+from collections import namedtuple
+
+import numpy as np
+
+from geodesy import bbox_dimensions
+from masks import PackedMask
+
+# Splits areas too large for one Process API request (at most 2500 px a side) into a
+# grid of pixel-aligned WGS84 tiles and mosaics the per-tile results back together.
+# Tile edges fall exactly on pixel boundaries of the full-area grid, so tiles neither
+# overlap nor leave seams, and column edges are multiples of 8 so packed masks can be
+# mosaicked byte-wise without unpacking.
+
+MAX_TILE_PIXELS = 2500
+
+# `window` is (y0, y1, x0, x1) in the full-area array (row 0 is the northern edge),
+# `size` the (width, height) to request for the tile.
+Tile = namedtuple("Tile", ["row", "col", "bbox", "window", "size"])
+
+
+def _edges(length, max_pixels, align=1):
+    # Rounding edges to `align` can grow a tile by up to `align` pixels
+    usable = max_pixels - align if align > 1 else max_pixels
+    count = max(1, math.ceil(length / usable))
+    edges = [round(length * i / count / align) * align for i in range(count)]
+    return edges + [length]
+
+
+def split_bbox(bounding_box, resolution, max_pixels=MAX_TILE_PIXELS):
+    """Grid of tiles covering `bounding_box` (west, south, east, north) at `resolution` metres.
+
+    Returns the tiles and the (height, width) of the full-area array, which is the size
+    sentinelhub's bbox_to_dimensions gives the area.
+    """
+    west, south, east, north = bounding_box
+    width, height = bbox_dimensions(bounding_box, resolution)[0].tolist()
+    if width == 0 or height == 0:
+        raise ValueError(f"Bounding box {bounding_box} is empty at {resolution} m resolution")
+
+    x_edges = _edges(width, max_pixels, align=8)
+    y_edges = _edges(height, max_pixels)
+    tiles = []
+    for row, (y0, y1) in enumerate(zip(y_edges, y_edges[1:])):
+        for col, (x0, x1) in enumerate(zip(x_edges, x_edges[1:])):
+            tile_bbox = (
+                west + (east - west) * x0 / width,
+                north - (north - south) * y1 / height,
+                west + (east - west) * x1 / width,
+                north - (north - south) * y0 / height,
+            )
+            tiles.append(Tile(row, col, tile_bbox, (y0, y1, x0, x1), (x1 - x0, y1 - y0)))
+    return tiles, (height, width)
+
+
+def mosaic(tiles, arrays, shape, fill=0):
+    """Paste per-tile arrays into one (height, width, ...) array; missing tiles (None) keep `fill`."""
+    sample = next(array for array in arrays if array is not None)
+    out = np.full(tuple(shape) + sample.shape[2:], fill, dtype=sample.dtype)
+    for tile, array in zip(tiles, arrays):
+        if array is None:
+            continue
+        y0, y1, x0, x1 = tile.window
+        out[y0:y1, x0:x1] = array
+    return out
+
+
+def mosaic_masks(tiles, masks, shape):
+    """`mosaic` for PackedMasks, copying packed bytes; missing tiles count as dry."""
+    height, width = shape
+    bits = np.zeros((height, (width + 7) // 8), dtype=np.uint8)
+    for tile, mask in zip(tiles, masks):
+        if mask is None:
+            continue
+        y0, y1, x0, _ = tile.window
+        bits[y0:y1, x0 // 8:x0 // 8 + mask.bits.shape[1]] = mask.bits
+    return PackedMask(bits, shape)
+
+
+def threshold_tile(raster, threshold):
+    """Per-tile water mask; a top-level function so it can run in a process pool."""
+    return PackedMask.from_bool(np.asarray(raster) > threshold)
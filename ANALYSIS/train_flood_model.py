@@ -0,0 +1,174 @@
+import argparse
+import os
+from pathlib import Path
+
+import numpy as np
+from dotenv import load_dotenv
+
+# MCDWD_MODEL_PATH and hdf_access's HDF_HANDLE_CACHE_SIZE are read at import
+load_dotenv(dotenv_path=Path('.') / '.env')
+
+from hdf_access import open_tile
+
+# Trains the RUN1.PY RandomForest flood model on any number of MCDWD tiles without
+# holding them in memory. Pixel features are built a band of rows at a time straight
+# into float32 arrays, each class is reservoir-sampled down to a fixed budget (the
+# no-flood majority is otherwise millions of near-identical rows), and the forest is
+# fitted on all cores. The model is saved with its feature names. It takes MCDWD inputs,
+# so the APIs serve a Sentinel-2 model from train_spectral_model.py instead.
+
+FEATURE_NAMES = ["Flood_1Day", "Flood_2Day", "TotalCounts_1Day", "ChangeInFlood"]
+SOURCE_SUBDATASETS = ["Flood_1Day_250m", "Flood_2Day_250m", "TotalCounts_1Day_250m"]
+
+# Kept apart from the served model (flood_model.FLOOD_MODEL_PATH): the services can't compute MCDWD inputs
+MCDWD_MODEL_PATH = os.getenv("MCDWD_MODEL_PATH", "models/flood_mcdwd.joblib")
+
+CHUNK_ROWS = 256
+MAX_PER_CLASS = 1_000_000
+
+
+def pixel_features(flood_1day, flood_2day, total_counts_1day):
+    """(X, y) for every valid pixel: float32 (n, 4) features in FEATURE_NAMES order and 0/1 labels."""
+    flood_1day = np.asarray(flood_1day, dtype=np.float32).ravel()
+    flood_2day = np.asarray(flood_2day, dtype=np.float32).ravel()
+    total_counts_1day = np.asarray(total_counts_1day, dtype=np.float32).ravel()
+    valid = ~np.isnan(flood_1day) & ~np.isnan(flood_2day) & ~np.isnan(total_counts_1day)
+
+    X = np.empty((int(valid.sum()), len(FEATURE_NAMES)), dtype=np.float32)
+    X[:, 0] = flood_1day[valid]
+    X[:, 1] = flood_2day[valid]
+    X[:, 2] = total_counts_1day[valid]
+    np.subtract(X[:, 1], X[:, 0], out=X[:, 3])
+    y = (X[:, 0] > 0).astype(np.int8)  # 1 if flooding, 0 otherwise
+    return X, y
+
+
+def iter_tile_chunks(path, chunk_rows=CHUNK_ROWS):
+    """(X, y) per band of `chunk_rows` rows of one MCDWD file; only that band is read."""
+    tile = open_tile(path)
+    height, width = tile.shape(SOURCE_SUBDATASETS[0])[:2]
+    for y0 in range(0, height, chunk_rows):
+        window = (y0, min(y0 + chunk_rows, height), 0, width)
+        yield pixel_features(*(tile.read(name, window) for name in SOURCE_SUBDATASETS))
+
+
+def iter_store_chunks(store_path, chunk_rows=CHUNK_ROWS, start_date=None, end_date=None):
+    """(X, y) per band of rows and day from an ingest_mcdwd.py store."""
+    from ingest_mcdwd import FloodCube
+
+    with FloodCube(store_path) as cube:
+        for tile in cube.tiles():
+            height, width = cube.file[tile][SOURCE_SUBDATASETS[0]].shape[1:]
+            for y0 in range(0, height, chunk_rows):
+                window = (y0, min(y0 + chunk_rows, height), 0, width)
+                bands = [cube.read(tile, name, start_date, end_date, window)[1] for name in SOURCE_SUBDATASETS]
+                if bands[0] is None:
+                    break
+                for step in range(bands[0].shape[0]):
+                    yield pixel_features(*(band[step] for band in bands))
+
+
+class ClassReservoir:
+    """Uniform sample of at most `capacity` rows per class from a stream of (X, y) chunks.
+
+    Every row gets a random key and each class keeps the rows with the smallest keys,
+    so memory stays at `capacity` rows per class however long the stream is.
+    """
+
+    def __init__(self, capacity=MAX_PER_CLASS, seed=42):
+        self.capacity = capacity
+        self.rng = np.random.default_rng(seed)
+        self.samples = {}  # label -> (keys, X)
+        self.seen = {}
+
+    def add(self, X, y):
+        for label in np.unique(y).tolist():
+            rows = X[y == label]
+            keys = self.rng.random(len(rows))
+            self.seen[label] = self.seen.get(label, 0) + len(rows)
+            if label in self.samples:
+                kept_keys, kept = self.samples[label]
+                keys, rows = np.concatenate([kept_keys, keys]), np.concatenate([kept, rows])
+            if len(keys) > self.capacity:
+                keep = np.argpartition(keys, self.capacity)[:self.capacity]
+                keys, rows = keys[keep], rows[keep]
+            self.samples[label] = (keys, rows)
+
+    def arrays(self):
+        """Sampled (X, y) and per-row weights that restore each class's share of the full stream."""
+        labels = sorted(self.samples)
+        X = np.concatenate([self.samples[label][1] for label in labels])
+        y = np.concatenate([np.full(len(self.samples[label][1]), label, dtype=np.int8) for label in labels])
+        weights = np.concatenate([
+            np.full(len(self.samples[label][1]), self.seen[label] / len(self.samples[label][1]), dtype=np.float32)
+            for label in labels
+        ])
+        return X, y, weights
+
+
+def train(chunks, max_per_class=MAX_PER_CLASS, test_size=0.3, n_estimators=100, reweight=True):
+    """Fit the RandomForest on a stratified sample of `chunks`; returns the model and its held-out report."""
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.metrics import classification_report, confusion_matrix
+    from sklearn.model_selection import train_test_split
+
+    reservoir = ClassReservoir(max_per_class)
+    for X, y in chunks:
+        reservoir.add(X, y)
+    print(f"Pixels seen per class: {reservoir.seen}")
+    X, y, weights = reservoir.arrays()
+    X_train, X_test, y_train, y_test, w_train, _ = train_test_split(
+        X, y, weights, test_size=test_size, stratify=y, random_state=42,
+    )
+
+    model = RandomForestClassifier(n_estimators=n_estimators, random_state=42, n_jobs=-1)
+    model.fit(X_train, y_train, sample_weight=w_train if reweight else None)
+
+    y_pred = model.predict(X_test)
+    return model, f"{confusion_matrix(y_test, y_pred)}\n{classification_report(y_test, y_pred)}"
+
+
+def save_model(model, path=MCDWD_MODEL_PATH, feature_names=FEATURE_NAMES):
+    import joblib
+
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    joblib.dump({"model": model, "feature_names": list(feature_names)}, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the RandomForest flood model out of core over many MCDWD tiles")
+    parser.add_argument("sources", nargs="*", help="MCDWD .hdf files or directories of them")
+    parser.add_argument("--store", help="ingest_mcdwd.py store to read instead of / as well as the files")
+    parser.add_argument("--start-date")
+    parser.add_argument("--end-date")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    parser.add_argument("--max-per-class", type=int, default=MAX_PER_CLASS)
+    parser.add_argument("--test-size", type=float, default=0.3)
+    parser.add_argument("--no-reweight", action="store_true", help="fit on the balanced sample as is")
+    parser.add_argument("--output", default=MCDWD_MODEL_PATH)
+    args = parser.parse_args()
+
+    paths = []
+    for source in args.sources:
+        if os.path.isdir(source):
+            from ingest_mcdwd import scan_tiles
+            paths += [path for _, _, path in scan_tiles(source)]
+        else:
+            paths.append(source)
+
+    def chunks():
+        for path in paths:
+            print(f"Reading {path}")
+            yield from iter_tile_chunks(path, args.chunk_rows)
+        if args.store:
+            yield from iter_store_chunks(args.store, args.chunk_rows, args.start_date, args.end_date)
+
+    model, report = train(chunks(), args.max_per_class, args.test_size, reweight=not args.no_reweight)
+    print(report)
+    save_model(model, args.output)
+    print(f"Saved model to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
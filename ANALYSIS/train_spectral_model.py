@@ -0,0 +1,79 @@
+import argparse
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+from dotenv import load_dotenv
+
+# flood_model reads FLOOD_MODEL_PATH and its worker settings when it is imported
+load_dotenv(dotenv_path=Path('.') / '.env')
+
+from flood_model import FLOOD_MODEL_PATH, spectral_features
+from indices import RAW_BANDS
+from train_flood_model import MAX_PER_CLASS, save_model, train
+
+# Trains the flood model the APIs serve (flood_model.py): the RandomForest of
+# train_flood_model.py, on Sentinel-2 reflectances and indices the services compute
+# themselves, labelled by flood masks over known events (MCDWD maps resampled onto the
+# area, rasterised survey polygons, ...). Example:
+#
+#   python train_spectral_model.py labels.json
+#
+# labels.json lists {"bbox": [west, south, east, north], "time_interval": [start, end],
+# "mask": "event.npy"} entries. A mask is a 2-D uint8 array over its bbox, north row
+# first: 1 flooded, 0 dry, anything else unlabelled. Its bands are fetched at the
+# mask's size, so each mask is at most 2500 px a side (the Process API limit).
+
+SPECTRAL_FEATURE_NAMES = RAW_BANDS + ["ndwi", "ndvi", "ndmi"]
+
+
+def pixel_features(bands, labels, feature_names=SPECTRAL_FEATURE_NAMES):
+    """(X, y) for every labelled pixel with data: float32 features in `feature_names` order and 0/1 labels."""
+    features = spectral_features(bands, feature_names)
+    X = np.stack([np.asarray(features[name], dtype=np.float32).ravel() for name in feature_names], axis=1)
+    labels = np.asarray(labels).ravel()
+    valid = ((labels == 0) | (labels == 1)) & ~np.isnan(X).any(axis=1)
+    return X[valid], labels[valid].astype(np.int8)
+
+
+def iter_label_chunks(entries, config, base_dir=".", feature_names=SPECTRAL_FEATURE_NAMES):
+    """(X, y) per labelled event, its bands downloaded from the Process API."""
+    from sentinelhub import CRS, BBox
+
+    from products import fetch_bands
+
+    for entry in entries:
+        labels = np.load(os.path.join(base_dir, entry["mask"]))
+        height, width = labels.shape
+        print(f"Fetching bands for {entry['mask']} ({width}x{height})")
+        bands = fetch_bands(BBox(bbox=tuple(entry["bbox"]), crs=CRS.WGS84), (width, height), tuple(entry["time_interval"]), config)
+        yield pixel_features(bands, labels, feature_names)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the served flood model on Sentinel-2 bands and labelled flood masks")
+    parser.add_argument("labels", help='JSON file: [{"bbox": [west, south, east, north], "time_interval": [start, end], "mask": "x.npy"}, ...]')
+    parser.add_argument("--max-per-class", type=int, default=MAX_PER_CLASS)
+    parser.add_argument("--test-size", type=float, default=0.3)
+    parser.add_argument("--no-reweight", action="store_true", help="fit on the balanced sample as is")
+    parser.add_argument("--output", default=FLOOD_MODEL_PATH)
+    args = parser.parse_args()
+
+    from sentinelhub import SHConfig
+
+    config = SHConfig()
+    if not config.sh_client_id or not config.sh_client_secret:
+        raise Exception("Please provide the Sentinel Hub credentials in the .env file.")
+
+    with open(args.labels) as f:
+        entries = json.load(f)
+    chunks = iter_label_chunks(entries, config, os.path.dirname(args.labels))
+    model, report = train(chunks, args.max_per_class, args.test_size, reweight=not args.no_reweight)
+    print(report)
+    save_model(model, args.output, SPECTRAL_FEATURE_NAMES)
+    print(f"Saved model to {args.output}")
+
+
+if __name__ == "__main__":
+    main()